@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import json
+import numpy as np
+import os.path
+import pandas as pd
+import sys
+import tempfile
+import yaml
+
+from compute_list import LoadedNamespaces, Names
+from compute_namespaces import Namespaces
+from concurrent.futures import ProcessPoolExecutor
+from gmara import Namespace, NamespaceLinks
+from multiprocessing import get_context
+from normalization import read_sources
+from profiling import Profiler
+
+COLUMNS = [
+    ("Ensembl ID", dict(namespace = "Ensembl")),
+    ("Symbol", dict(namespace = "Symbol")),
+    ("Aliases", dict(namespace = "Symbol", is_alternative = True)),
+    ("RefSeq IDs", dict(namespace = "RefSeq")),
+    ("HGNC ID", dict(namespace = "HGNC")),
+    ("UCSC ID", dict(namespace = "UCSC")),
+]
+
+SEPARATORS = np.array(["|", ",", ";"], dtype = object)
+
+MISSING_NAMES_COUNT = 10
+
+class Case:
+    def __init__(self, rows_count, *, columns_count, multi_valued, cluster_size, versioned, seed):
+        assert 2 <= columns_count <= len(COLUMNS), f"the number of columns must be between 2 and {len(COLUMNS)}"
+        self.rows_count = rows_count
+        self.columns_count = columns_count
+        self.multi_valued = multi_valued
+        self.cluster_size = cluster_size
+        self.versioned = versioned
+        self.seed = seed
+
+    @property
+    def name(self):
+        return f"rows={self.rows_count} columns={self.columns_count} multi_valued={self.multi_valued} " \
+            f"cluster_size={self.cluster_size} versioned={self.versioned} seed={self.seed}"
+
+    def generate(self, case_dir):
+        print(f"Generate {self.rows_count} rows ...", flush = True)
+        random = np.random.default_rng(self.seed)
+        gene_ids = pd.Series(np.arange(self.rows_count)).astype(str)
+        other_gene_ids = pd.Series(np.arange(self.rows_count, 2 * self.rows_count)).astype(str)
+        columns = {
+            "Ensembl ID": self.multi_valued_names(
+                random,
+                self.versioned_names(random, "ENSG" + gene_ids.str.zfill(11)),
+                self.versioned_names(random, "ENSG" + other_gene_ids.str.zfill(11)),
+            ),
+            "Symbol": "GENE" + gene_ids,
+            "Aliases": self.multi_valued_names(
+                random,
+                "ALIAS" + (pd.Series(np.arange(self.rows_count)) // self.cluster_size).astype(str),
+                "SYN" + gene_ids,
+            ),
+            "RefSeq IDs": self.multi_valued_names(
+                random,
+                self.versioned_names(random, "NM_" + gene_ids.str.zfill(9)),
+                self.versioned_names(random, "NR_" + gene_ids.str.zfill(9)),
+            ),
+            "HGNC ID": "HGNC:" + gene_ids,
+            "UCSC ID": "uc" + gene_ids.str.zfill(6) + "." + pd.Series(random.integers(1, 10, self.rows_count)).astype(str),
+        }
+
+        sources_dir = f"{case_dir}/namespaces/sources"
+        os.makedirs(sources_dir, exist_ok = True)
+        columns_spec = dict(COLUMNS[:self.columns_count])
+        pd.DataFrame({ column: columns[column] for column in columns_spec }).to_csv(
+            f"{sources_dir}/Genes.tsv",
+            sep = "\t",
+            index = False,
+        )
+        with open(f"{sources_dir}/sources.yaml", "w") as file:
+            yaml.safe_dump(
+                [dict(data_file = "Genes.tsv", columns = columns_spec), dict(namespace = "UCSC", keep_version = True)],
+                file,
+                sort_keys = False,
+            )
+
+        list_size = min(self.rows_count, max(100, self.rows_count // 100))
+        list_names = np.concatenate([
+            np.asarray("GENE" + gene_ids[random.choice(self.rows_count, list_size, replace = False)], dtype = object),
+            np.array([f"MISSING{index}" for index in range(MISSING_NAMES_COUNT)], dtype = object),
+        ])
+        list_sources_dir = f"{case_dir}/list/sources"
+        os.makedirs(list_sources_dir, exist_ok = True)
+        pd.DataFrame({ "Symbol": list_names }).to_csv(f"{list_sources_dir}/List.tsv", sep = "\t", index = False)
+        with open(f"{list_sources_dir}/sources.yaml", "w") as file:
+            yaml.safe_dump([dict(data_file = "List.tsv", columns = { "Symbol": "Symbol" })], file, sort_keys = False)
+
+    def versioned_names(self, random, names):
+        is_versioned = random.random(len(names)) < self.versioned
+        versions = pd.Series(random.integers(1, 20, len(names))).astype(str)
+        return names.where(~is_versioned, names + "." + versions)
+
+    def multi_valued_names(self, random, names, other_names):
+        is_multi_valued = random.random(len(names)) < self.multi_valued
+        separators = pd.Series(SEPARATORS[random.integers(0, len(SEPARATORS), len(names))])
+        return names.where(~is_multi_valued, names + separators + other_names)
+
+def benchmark_case(case_dir, jobs):
+    profiler = Profiler(f"{case_dir}/profile.json")
+    namespaces_dir = f"{case_dir}/namespaces"
+    sources_dir = f"{namespaces_dir}/sources"
+    list_sources_dir = f"{case_dir}/list/sources"
+    sources_spec, normalizer = read_sources(f"{sources_dir}/sources.yaml")
+    with open(f"{list_sources_dir}/sources.yaml") as file:
+        list_sources_spec = yaml.safe_load(file)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        namespaces = Namespaces(sources_dir, normalizer)
+        with profiler.stage("Namespaces.collect_source") as counts:
+            for source_spec in sources_spec:
+                namespaces.collect_source(source_spec)
+            counts.update(namespaces.counts())
+        with profiler.stage("Namespaces.complete_links") as counts:
+            namespaces.complete_links()
+            counts["links"] = len(namespaces.link_sources)
+            counts["largest_component"] = int(namespaces.component_sizes.max(initial = 0))
+        with profiler.stage("Namespaces.ensure_canonical") as counts:
+            namespaces.ensure_canonical(jobs = jobs)
+            counts["canonical"] = int(np.count_nonzero(namespaces.is_canonical))
+        with profiler.stage("Namespaces.write") as counts:
+            counts["links"] = namespaces.write(f"{namespaces_dir}/names", f"{namespaces_dir}/index.bin", jobs = jobs)
+        namespace_names = list(namespaces.namespaces)
+        del namespaces
+
+        with profiler.stage("NamespaceMap from names") as counts:
+            loaded_namespaces = {
+                namespace_name: Namespace(namespaces_dir, namespace_name)
+                for namespace_name in namespace_names
+            }
+            namespaces_links = [
+                NamespaceLinks(namespaces_dir, loaded_namespaces[first_namespace_name], loaded_namespaces[second_namespace_name])
+                for first_namespace_name in sorted(namespace_names)
+                for second_namespace_name in sorted(namespace_names)
+                if first_namespace_name <= second_namespace_name
+            ]
+            counts["links"] = sum(len(namespace_links.first_ids) for namespace_links in namespaces_links)
+        del loaded_namespaces, namespaces_links
+
+        with profiler.stage("NamespaceMap from index") as counts:
+            loaded_namespaces = LoadedNamespaces(namespaces_dir)
+            counts["names"] = sum(len(namespace.sorted_gene_names) for namespace in loaded_namespaces.namespaces.values())
+            for from_namespace_name in loaded_namespaces.namespaces:
+                for to_namespace_name in loaded_namespaces.namespaces:
+                    loaded_namespaces.namespace_map(from_namespace_name, to_namespace_name)
+            counts["links"] = loaded_namespaces.links_count()
+        names = Names(list_sources_dir, namespaces_dir, loaded_namespaces)
+        for source_spec in list_sources_spec:
+            names.collect_source(source_spec)
+        names.verify_names()
+        with profiler.stage("Names.complete_names") as counts:
+            names.complete_names()
+            counts["names"] = names.names_count()
+
+    return profiler.stages, profiler.overall_peak_rss_bytes()
+
+def run_case(case, work_dir, repeat, jobs):
+    case_dir = f"{work_dir}/{case.rows_count}"
+    case.generate(case_dir)
+    stages = {}
+    case_peak_rss_bytes = None
+    for _repeat in range(repeat):
+        print(f"Benchmark {case.rows_count} rows ...", flush = True)
+        with ProcessPoolExecutor(max_workers = 1, mp_context = get_context("spawn")) as executor:
+            repeat_stages, repeat_peak_rss_bytes = executor.submit(benchmark_case, case_dir, jobs).result()
+        for stage in repeat_stages:
+            best_stage = stages.get(stage["name"])
+            if best_stage is None or stage["wall_seconds"] < best_stage["wall_seconds"]:
+                stages[stage["name"]] = stage
+        case_peak_rss_bytes = min(repeat_peak_rss_bytes, case_peak_rss_bytes or repeat_peak_rss_bytes)
+    return dict(
+        name = case.name,
+        rows_count = case.rows_count,
+        peak_rss_bytes = case_peak_rss_bytes,
+        stages = { name: dict(
+            wall_seconds = stage["wall_seconds"],
+            cpu_seconds = stage["cpu_seconds"],
+            counts = stage["counts"],
+        ) for name, stage in stages.items() },
+    )
+
+def print_results(results):
+    stage_names = list(dict.fromkeys(name for result in results for name in result["stages"]))
+    for stage_name in stage_names:
+        print(f"\n{stage_name}:")
+        print(f"{"rows":>10} {"wall (s)":>10} {"cpu (s)":>10} {"time ratio":>11}")
+        previous_stage = None
+        for result in results:
+            stage = result["stages"].get(stage_name)
+            if stage is None:
+                continue
+            if previous_stage is None or previous_stage["wall_seconds"] == 0:
+                ratio = ""
+            else:
+                ratio = f"x{stage["wall_seconds"] / previous_stage["wall_seconds"]:.1f}"
+            print(f"{result["rows_count"]:>10} {stage["wall_seconds"]:>10.3f} {stage["cpu_seconds"]:>10.3f} {ratio:>11}")
+            previous_stage = stage
+
+    print("\nOverall:")
+    print(f"{"rows":>10} {"peak RSS (MB)":>14}")
+    for result in results:
+        print(f"{result["rows_count"]:>10} {result["peak_rss_bytes"] / 2 ** 20:>14.1f}")
+
+def find_regressions(results, baseline, *, time_tolerance, memory_tolerance, time_slack, memory_slack):
+    baseline_results = { result["name"]: result for result in baseline["results"] }
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get(result["name"])
+        if baseline_result is None:
+            regressions.append(f"no baseline for: {result["name"]}")
+            continue
+        if result["peak_rss_bytes"] > baseline_result["peak_rss_bytes"] * (1 + memory_tolerance) + memory_slack:
+            regressions.append(
+                f"{result["rows_count"]} rows: peak_rss_bytes {result["peak_rss_bytes"]:.6g} "
+                f"exceeds the baseline {baseline_result["peak_rss_bytes"]:.6g}"
+            )
+        for stage_name, stage in result["stages"].items():
+            baseline_stage = baseline_result["stages"].get(stage_name)
+            if baseline_stage is None:
+                continue
+            if stage["wall_seconds"] > baseline_stage["wall_seconds"] * (1 + time_tolerance) + time_slack:
+                regressions.append(
+                    f"{stage_name} with {result["rows_count"]} rows: wall_seconds {stage["wall_seconds"]:.6g} "
+                    f"exceeds the baseline {baseline_stage["wall_seconds"]:.6g}"
+                )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the computation of namespaces and lists on synthetic data.")
+    parser.add_argument("--rows", default = "10000,100000,1000000,10000000", help = "comma separated numbers of source rows")
+    parser.add_argument("--columns", type = int, default = len(COLUMNS), help = "number of columns in the source")
+    parser.add_argument("--multi-valued", type = float, default = 0.2, help = "fraction of cells holding two names")
+    parser.add_argument("--cluster-size", type = int, default = 4, help = "number of genes sharing each alias")
+    parser.add_argument("--versioned", type = float, default = 0.5, help = "fraction of identifiers with a version suffix")
+    parser.add_argument("--seed", type = int, default = 1, help = "seed of the random data")
+    parser.add_argument("--jobs", type = int, default = os.cpu_count(), help = "maximal number of processes canonicalizing and writing the names")
+    parser.add_argument("--repeat", type = int, default = 1, help = "number of runs of each size (the fastest is kept)")
+    parser.add_argument("--work-dir", help = "directory for the generated data (default: a temporary directory)")
+    parser.add_argument("--output", default = "benchmark/results.json", help = "where to write the results")
+    parser.add_argument("--baseline", default = "benchmark/baseline.json", help = "results to compare with")
+    parser.add_argument("--save-baseline", action = "store_true", help = "store the results as the new baseline")
+    parser.add_argument("--time-tolerance", type = float, default = 0.25, help = "allowed relative slowdown")
+    parser.add_argument("--memory-tolerance", type = float, default = 0.1, help = "allowed relative memory growth")
+    parser.add_argument("--time-slack", type = float, default = 0.05, help = "allowed absolute slowdown in seconds")
+    parser.add_argument("--memory-slack", type = float, default = 16, help = "allowed absolute memory growth in MB")
+    args = parser.parse_args()
+
+    cases = [
+        Case(
+            int(rows_count),
+            columns_count = args.columns,
+            multi_valued = args.multi_valued,
+            cluster_size = args.cluster_size,
+            versioned = args.versioned,
+            seed = args.seed,
+        )
+        for rows_count in args.rows.split(",")
+    ]
+
+    with contextlib.ExitStack() as stack:
+        work_dir = args.work_dir or stack.enter_context(tempfile.TemporaryDirectory(prefix = "gmara-benchmark-"))
+        results = [run_case(case, work_dir, args.repeat, args.jobs) for case in cases]
+
+    print_results(results)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok = True)
+    print(f"\nWrite {args.output} ...", flush = True)
+    with open(args.output, "w") as file:
+        json.dump(dict(results = results), file, indent = 2)
+        file.write("\n")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok = True)
+        print(f"Write {args.baseline} ...", flush = True)
+        with open(args.baseline, "w") as file:
+            json.dump(dict(results = results), file, indent = 2)
+            file.write("\n")
+        return
+
+    assert os.path.isfile(args.baseline), \
+        f"no baseline: {args.baseline} (run with --save-baseline first to create it on this machine)"
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = find_regressions(
+        results,
+        baseline,
+        time_tolerance = args.time_tolerance,
+        memory_tolerance = args.memory_tolerance,
+        time_slack = args.time_slack,
+        memory_slack = args.memory_slack * 2 ** 20,
+    )
+    for regression in regressions:
+        print(f"Regression: {regression}", flush = True)
+    if len(regressions) > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
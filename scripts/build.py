@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import os.path
+import traceback
+
+from complete_namespaces import complete_namespaces
+from compute_lists import compute_lists, find_lists
+from compute_namespaces import compute_namespaces
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from curation import CurationStore
+from multiprocessing import get_context
+
+def main():
+    parser = argparse.ArgumentParser(description = "Build the namespaces and lists of all the species.")
+    parser.add_argument("--jobs", type = int, default = os.cpu_count(), help = "maximal number of processes")
+    parser.add_argument("--incremental", action = "store_true", help = "reuse the cached parsing of unchanged sources")
+    parser.add_argument("--offline", action = "store_true", help = "do not complete the missing names using web APIs")
+    parser.add_argument("species", nargs = "*", help = "the species to build (default: all of them)")
+    args = parser.parse_args()
+
+    species_names = args.species or find_species()
+    species_jobs = max(1, min(args.jobs, len(species_names)))
+    namespaces_jobs = max(1, args.jobs // species_jobs)
+
+    failed_species_names = []
+    with ProcessPoolExecutor(max_workers = species_jobs, mp_context = get_context("fork")) as executor:
+        futures = {
+            executor.submit(
+                build_species,
+                species,
+                incremental = args.incremental,
+                offline = args.offline,
+                jobs = namespaces_jobs,
+            ): species
+            for species in species_names
+        }
+        for future in as_completed(futures):
+            species = futures[future]
+            try:
+                future.result()
+                print(f"Built genes/{species}", flush = True)
+            except Exception:
+                traceback.print_exc()
+                print(f"Failed to build genes/{species}", flush = True)
+                failed_species_names.append(species)
+
+    assert len(failed_species_names) == 0, f"failed to build the species: {" ".join(sorted(failed_species_names))}"
+
+def build_species(species, *, incremental, offline, jobs):
+    print(f"Build genes/{species}/namespaces ...", flush = True)
+    with log_to(f"genes/{species}/namespaces/log.txt"):
+        compute_namespaces(species, incremental = incremental, jobs = jobs)
+
+    curation = CurationStore(f"genes/{species}/namespaces")
+    with curation.transaction():
+        for namespace_name in curation.missing_namespace_names():
+            curation.remove_missing(namespace_name)
+    curation.close()
+
+    list_names = find_lists(species)
+    for list_name in list_names:
+        print(f"Build genes/{species}/lists/{list_name} ...", flush = True)
+        open(f"genes/{species}/lists/{list_name}/log.txt", "w").close()
+    with log_to(f"genes/{species}/lists/log.txt"):
+        if len(list_names) > 0:
+            compute_lists(
+                species,
+                list_names,
+                append_missing = True,
+                list_log = lambda list_name: log_to(f"genes/{species}/lists/{list_name}/log.txt", mode = "a"),
+            )
+
+    if not offline:
+        print(f"Complete genes/{species}/namespaces ...", flush = True)
+        with log_to(f"genes/{species}/lists/log.txt", mode = "a"):
+            complete_namespaces(species)
+
+@contextlib.contextmanager
+def log_to(log_path, *, mode = "w"):
+    with open(log_path, mode) as file, contextlib.redirect_stdout(file), contextlib.redirect_stderr(file):
+        yield
+
+def find_species():
+    return sorted(
+        species
+        for species in os.listdir("genes")
+        if os.path.isfile(f"genes/{species}/namespaces/sources/sources.yaml")
+    )
+
+if __name__ == "__main__":
+    main()
@@ -1,122 +1,323 @@
 #!/usr/bin/env python3
 
+import argparse
+import hashlib
 import json
 import os
 import requests
-import sys
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+from curation import CurationStore
+from normalization import read_sources
+from profiling import Profiler, add_profile_arguments, args_profiler
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+
+TARK_URL = os.environ.get("GMARA_TARK_URL", "http://tark.ensembl.org")
+UCSC_URL = os.environ.get("GMARA_UCSC_URL", "http://api.genome.ucsc.edu")
+ENSEMBL_URL = os.environ.get("GMARA_ENSEMBL_URL", "https://rest.ensembl.org")
+
+ENSEMBL_BATCH_SIZE = 1000
+MAX_REGION_SIZE = 5_000_000
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate)
+                self.time = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+class Fetcher:
+    def __init__(self, cache_dir, *, jobs = 8, rate = 10, retries = 5, backoff = 0.5):
+        self.cache_dir = cache_dir
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = 4, pool_maxsize = jobs)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers = jobs)
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.counts = dict(requests = 0, retries = 0, cached = 0)
+        self.counts_lock = threading.Lock()
+
+    def count(self, name):
+        with self.counts_lock:
+            self.counts[name] += 1
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+    def get_json(self, url):
+        return self.executor.submit(self.fetch_json, url).result()
+
+    def get_jsons(self, urls):
+        futures = [self.executor.submit(self.fetch_json, url) for url in urls]
+        return [future.result() for future in futures]
+
+    def post_jsons(self, url, payloads, *, is_optional = False):
+        futures = [self.executor.submit(self.fetch_json, url, payload) for payload in payloads]
+        return [self.future_result(future, is_optional) for future in futures]
+
+    def future_result(self, future, is_optional):
+        if not is_optional:
+            return future.result()
+        try:
+            return future.result()
+        except (RuntimeError, requests.RequestException) as exception:
+            print(f"Skip failed request: {exception}", flush = True)
+            return None
+
+    def fetch_json(self, url, payload = None):
+        cache_path = None
+        if self.cache_dir is not None:
+            cache_key = url if payload is None else f"{url}\n{json.dumps(payload, sort_keys = True)}"
+            cache_path = f"{self.cache_dir}/{hashlib.sha256(cache_key.encode()).hexdigest()}.json"
+            if os.path.isfile(cache_path):
+                self.count("cached")
+                with open(cache_path, "rb") as file:
+                    return json.loads(file.read())
+
+        content = self.fetch(url, payload)
+        data = json.loads(content)
+
+        if cache_path is not None:
+            os.makedirs(self.cache_dir, exist_ok = True)
+            with open(f"{cache_path}.{threading.get_ident()}.tmp", "wb") as file:
+                file.write(content)
+            os.replace(f"{cache_path}.{threading.get_ident()}.tmp", cache_path)
+        return data
+
+    def fetch(self, url, payload = None):
+        bucket = self.bucket(urlsplit(url).netloc)
+        for attempt in range(self.retries + 1):
+            bucket.acquire()
+            self.count("requests" if attempt == 0 else "retries")
+            try:
+                if payload is None:
+                    page = self.session.get(url, timeout = 60)
+                else:
+                    page = self.session.post(url, json = payload, headers = { "Accept": "application/json" }, timeout = 60)
+                if page.status_code != 429 and page.status_code < 500:
+                    page.raise_for_status()
+                    return page.content
+                error = f"HTTP status {page.status_code}"
+                delay = float(page.headers.get("Retry-After", self.backoff * 2 ** attempt))
+            except requests.ConnectionError as exception:
+                error = str(exception)
+                delay = self.backoff * 2 ** attempt
+            except requests.Timeout as exception:
+                error = str(exception)
+                delay = self.backoff * 2 ** attempt
+            if attempt < self.retries:
+                print(f"Retry {url} in {delay} seconds after: {error}", flush = True)
+                time.sleep(delay)
+        raise RuntimeError(f"failed to fetch: {url} error: {error}")
+
+    def bucket(self, host):
+        with self.buckets_lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.rate)
+            return self.buckets[host]
+
 def main():
-    assert len(sys.argv) == 2, "Usage: complete_namespaces.py species"
-    species = sys.argv[1]
+    parser = argparse.ArgumentParser(description = "Complete the missing names of the namespaces of a species using web APIs.")
+    parser.add_argument("--jobs", type = int, default = 8, help = "maximal number of requests in flight")
+    parser.add_argument("--rate", type = float, default = 10, help = "maximal number of requests per second per host")
+    parser.add_argument("--no-cache", action = "store_true", help = "do not reuse or store web API responses")
+    add_profile_arguments(parser)
+    parser.add_argument("species")
+    args = parser.parse_args()
+    profiler = args_profiler(args, f"genes/{args.species}/lists")
+    complete_namespaces(args.species, jobs = args.jobs, rate = args.rate, use_cache = not args.no_cache, profiler = profiler)
+    profiler.write()
 
+def complete_namespaces(species, *, jobs = 8, rate = 10, use_cache = True, profiler = None):
+    profiler = profiler or Profiler()
     sources_dir = f"genes/{species}/namespaces/sources"
-    for name in os.listdir(sources_dir):
-        if name.endswith(".Missing.txt"):
-            namespace_name = name[:-12]
-            complete_namespace(namespace_name, sources_dir)
+    cache_dir = f"genes/{species}/namespaces/cache/http" if use_cache else None
+    _sources_spec, normalizer = read_sources(f"{sources_dir}/sources.yaml")
+    curation = CurationStore(f"genes/{species}/namespaces")
+    fetcher = Fetcher(cache_dir, jobs = jobs, rate = rate)
+    try:
+        for namespace_name in curation.missing_namespace_names():
+            with profiler.stage(f"complete {namespace_name}") as counts:
+                fetcher_counts = dict(fetcher.counts)
+                counts.update(complete_namespace(namespace_name, curation, fetcher, normalizer))
+                for name, count in fetcher.counts.items():
+                    counts[name] = count - fetcher_counts[name]
+    finally:
+        fetcher.close()
+        curation.close()
 
-def complete_namespace(namespace_name, sources_dir):
+def complete_namespace(namespace_name, curation, fetcher, normalizer):
     print(f"Complete identifiers for {namespace_name} ...")
     complete_function = globals().get(f"complete_{namespace_name}")
 
-    missing_path = f"{sources_dir}/{namespace_name}.Missing.txt"
-    if os.path.isfile(missing_path):
-        missing_names = set(open(missing_path))
-    else:
-        missing_names = set()
+    with curation.transaction():
+        missing_names = curation.missing_names(namespace_name)
+        ignored_names = curation.ignored_names(namespace_name)
 
-    ignored_path = f"{sources_dir}/{namespace_name}.Ignored.txt"
-    if os.path.isfile(ignored_path):
-        ignored_names = set(open(ignored_path))
+    gene_names = {}
+    for gene_name in missing_names:
+        gene_name = normalizer.normalize_name(namespace_name, gene_name)
+        if gene_name not in ignored_names:
+            gene_names[gene_name] = True
+    gene_names = list(gene_names)
+
+    if complete_function is None or len(gene_names) == 0:
+        genes_extras = {}
     else:
-        ignored_names = set()
+        genes_extras = complete_function(fetcher, normalizer, gene_names)
 
-    for gene_name in sorted(missing_names):
-        gene_name = normalize_name(namespace_name, gene_name[:-1])
-        if gene_name not in ignored_names \
-                and (complete_function is None or not complete_function(sources_dir, gene_name)):
-            ignored_names.add(gene_name)
+    extras = {}
+    new_ignored_names = []
+    for gene_name in gene_names:
+        gene_extras = genes_extras.get(gene_name, {})
+        for extra_path, other_gene_names in sorted(gene_extras.items()):
+            print(f"Found {len(other_gene_names)} mappings for the missing {namespace_name} {gene_name} in {extra_path}")
+            extras.setdefault(extra_path, []).extend((gene_name, other_gene_name) for other_gene_name in sorted(other_gene_names))
+        if len(gene_extras) == 0:
             print(f"The missing gene: '{gene_name}' will be ignored from the namespace: {namespace_name}")
-            with open(ignored_path, "a") as file:
-                print(gene_name, file = file)
-
-    if os.path.isfile(missing_path):
-        os.remove(missing_path)
-
-def complete_Ensembl(sources_dir, ensembl_id):
-    url = f"http://tark.ensembl.org/api/transcript/search/?identifier_field={ensembl_id}&expand=genes"
-    time.sleep(0.01)  # Throttle requests to avoid appearing to be a DDOS attack.
-    page = requests.get(url)
-    data = json.loads(page.content)
-
-    active_ids = set()
-    for datum in data:
-        stable_id = normalize_name("Ensembl", datum.get("stable_id", ensembl_id))
-        if stable_id != ensembl_id:
-            active_ids.add(stable_id)
-        for gene in datum.get("genes", []):
-            stable_id = normalize_name("Ensembl", gene.get("stable_id", ensembl_id))
+            new_ignored_names.append(gene_name)
+
+    with curation.transaction():
+        for extra_path, gene_names_pairs in sorted(extras.items()):
+            curation.add_extras(extra_path, gene_names_pairs)
+        curation.add_ignored(namespace_name, new_ignored_names)
+        curation.remove_missing(namespace_name, missing_names)
+
+    return dict(missing = len(gene_names), resolved = len(gene_names) - len(new_ignored_names), ignored = len(new_ignored_names))
+
+def complete_Ensembl(fetcher, normalizer, ensembl_ids):
+    print(f"Look up {len(ensembl_ids)} Ensembl identifiers in the Ensembl archive ...", flush = True)
+    genes_active_ids = {}
+    archive_datas = fetcher.post_jsons(
+        f"{ENSEMBL_URL}/archive/id",
+        [{ "id": batch_ids } for batch_ids in batches(ensembl_ids, ENSEMBL_BATCH_SIZE)],
+        is_optional = True,
+    )
+    for archive_data in archive_datas:
+        for archive_datum in archive_data or []:
+            ensembl_id = normalizer.normalize_name("Ensembl", archive_datum.get("id", ""))
+            active_ids = set()
+            latest_id = normalizer.normalize_name("Ensembl", archive_datum.get("latest") or ensembl_id)
+            if latest_id != ensembl_id:
+                active_ids.add(latest_id)
+            for replacement in archive_datum.get("possible_replacement") or []:
+                replacement_id = normalizer.normalize_name("Ensembl", replacement.get("stable_id", ensembl_id))
+                if replacement_id != ensembl_id:
+                    active_ids.add(replacement_id)
+            if len(active_ids) > 0:
+                genes_active_ids.setdefault(ensembl_id, set()).update(active_ids)
+
+    remaining_ids = [ensembl_id for ensembl_id in ensembl_ids if ensembl_id not in genes_active_ids]
+    print(f"Look up {len(remaining_ids)} Ensembl identifiers in Tark ...", flush = True)
+    tark_datas = fetcher.get_jsons([
+        f"{TARK_URL}/api/transcript/search/?identifier_field={ensembl_id}&expand=genes"
+        for ensembl_id in remaining_ids
+    ])
+    for ensembl_id, tark_data in zip(remaining_ids, tark_datas):
+        active_ids = set()
+        for datum in tark_data:
+            stable_id = normalizer.normalize_name("Ensembl", datum.get("stable_id", ensembl_id))
             if stable_id != ensembl_id:
                 active_ids.add(stable_id)
+            for gene in datum.get("genes", []):
+                stable_id = normalizer.normalize_name("Ensembl", gene.get("stable_id", ensembl_id))
+                if stable_id != ensembl_id:
+                    active_ids.add(stable_id)
+        if len(active_ids) > 0:
+            genes_active_ids[ensembl_id] = active_ids
 
-    if len(active_ids) == 0:
-        return False
-
-    store_extra(sources_dir, "Ensembl.Extra.tsv", ensembl_id, active_ids)
-    print(f"Found {len(active_ids)} mappings for the missing Ensembl {ensembl_id}")
-    return True
-
-def complete_Symbol(sources_dir, symbol):
-    url = f"http://api.genome.ucsc.edu/search?search={symbol}&genome=hg38"
-    time.sleep(0.01)
-    page = requests.get(url)
-    data = json.loads(page.content)
-
-    symbols = set()
-    ensembl_ids = set()
-
-    for positionMatch in data["positionMatches"]:
-        for match in positionMatch["matches"]:
-            position = match["position"]
-            chromosome, locations = position.split(":")
-            start, end = locations.split("-")
-            chromosome = chromosome[3:]
-            time.sleep(0.01)
-            match_url = f"https://rest.ensembl.org/overlap/region/human/{chromosome}:{start}:{end}?feature=gene;content-type=application/json"
-            match_page = requests.get(match_url)
-            match_data = json.loads(match_page.content)
-            for match_datum in match_data:
-                if "external_name" in match_datum:
-                    symbols.add(normalize_name("Symbol", match_datum["external_name"]))
-                if "gene_id" in match_datum:
-                    ensembl_ids.add(normalize_name("Ensembl", match_datum["gene_id"]))
-                if "canonical_transcript" in match_datum:
-                    ensembl_ids.add(normalize_name("Ensembl", match_datum["canonical_transcript"]))
-
-    if len(symbols) > 0:
-        print(f"Found {len(symbols)} Symbol mappings for the missing Symbol {symbol}")
-        store_extra(sources_dir, "Symbol.Extra.tsv", symbol, symbols)
-
-    if len(ensembl_ids) > 0:
-        print(f"Found {len(ensembl_ids)} Ensembl mappings for the missing Symbol {symbol}")
-        store_extra(sources_dir, "Symbol.Ensembl.Extra.tsv", symbol, ensembl_ids)
-
-    return len(symbols) + len(ensembl_ids) > 0
-
-def normalize_name(namespace_name, name):
-    if namespace_name == "UCSC":
-        return name
-    parts = name.split(".")
-    if len(parts) == 2:
-        return parts[0]
-    else:
-        return name
+    return {
+        ensembl_id: { "Ensembl.Extra.tsv": active_ids }
+        for ensembl_id, active_ids in genes_active_ids.items()
+    }
+
+def complete_Symbol(fetcher, normalizer, symbols):
+    print(f"Search {len(symbols)} symbols in UCSC ...", flush = True)
+    search_datas = fetcher.get_jsons([f"{UCSC_URL}/search?search={symbol}&genome=hg38" for symbol in symbols])
+
+    symbols_regions = {}
+    for symbol, search_data in zip(symbols, search_datas):
+        regions = symbols_regions[symbol] = []
+        for positionMatch in search_data["positionMatches"]:
+            for match in positionMatch["matches"]:
+                position = match["position"]
+                chromosome, locations = position.split(":")
+                start, end = locations.split("-")
+                regions.append((chromosome[3:], int(start), int(end)))
+
+    merged_regions = merge_regions([region for regions in symbols_regions.values() for region in regions])
+    print(f"Look up {len(merged_regions)} merged regions in Ensembl ...", flush = True)
+    regions_datas = fetcher.get_jsons([
+        f"{ENSEMBL_URL}/overlap/region/human/{chromosome}:{start}:{end}?feature=gene;content-type=application/json"
+        for chromosome, start, end in merged_regions
+    ])
+    chromosomes_regions = {}
+    for (chromosome, start, end), region_data in zip(merged_regions, regions_datas):
+        chromosomes_regions.setdefault(chromosome, []).append((start, end, region_data))
+
+    genes_extras = {}
+    for symbol, regions in symbols_regions.items():
+        other_symbols = set()
+        ensembl_ids = set()
+        for chromosome, start, end in regions:
+            for merged_start, merged_end, region_data in chromosomes_regions[chromosome]:
+                if merged_start <= start and end <= merged_end:
+                    for match_datum in region_data:
+                        if match_datum.get("start", start) > end or match_datum.get("end", end) < start:
+                            continue
+                        if "external_name" in match_datum:
+                            other_symbols.add(normalizer.normalize_name("Symbol", match_datum["external_name"]))
+                        if "gene_id" in match_datum:
+                            ensembl_ids.add(normalizer.normalize_name("Ensembl", match_datum["gene_id"]))
+                        if "canonical_transcript" in match_datum:
+                            ensembl_ids.add(normalizer.normalize_name("Ensembl", match_datum["canonical_transcript"]))
+                    break
+
+        extras = {}
+        if len(other_symbols) > 0:
+            extras["Symbol.Extra.tsv"] = other_symbols
+        if len(ensembl_ids) > 0:
+            extras["Symbol.Ensembl.Extra.tsv"] = ensembl_ids
+        if len(extras) > 0:
+            genes_extras[symbol] = extras
+
+    return genes_extras
+
+def merge_regions(regions):
+    merged_regions = []
+    for chromosome, start, end in sorted(set(regions)):
+        if len(merged_regions) > 0:
+            merged_chromosome, merged_start, merged_end = merged_regions[-1]
+            if merged_chromosome == chromosome and start <= merged_end and max(end, merged_end) - merged_start <= MAX_REGION_SIZE:
+                merged_regions[-1] = (chromosome, merged_start, max(end, merged_end))
+                continue
+        merged_regions.append((chromosome, start, end))
+    return merged_regions
 
-def store_extra(sources_dir, extra_path, gene_name, other_gene_names):
-    with open(f"{sources_dir}/{extra_path}", "a+") as file:
-        for other_gene_name in sorted(other_gene_names):
-            print(f"{gene_name}\t{other_gene_name}", file = file)
+def batches(items, batch_size):
+    return [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
 
 if __name__ == "__main__":
     main()
@@ -1,56 +1,71 @@
 #!/usr/bin/env python3
 
+import argparse
+import numpy as np
 import os.path
 import pandas as pd
-import re
 import shutil
-import sys
 import yaml
 
-from glob import glob
-
-class Namespace:
-    def __init__(self, namespaces_dir, name):
-        self.name = name
-        names_path = f"{namespaces_dir}/names/{name}.tsv"
-        print(f"Load {name} names ...", flush = True)
-        frame = pd.read_csv(names_path, dtype = str, keep_default_na = False, header = "infer", sep = "\t")
-        self.gene_names = set(frame.loc[:, "name"])
-
-class NamespaceMap:
-    def __init__(self, namespaces_dir, from_name, to_name):
-        names_path = f"{namespaces_dir}/names/{from_name}.{to_name}.tsv"
-        print(f"Load mapping from {from_name} to {to_name} ...", flush = True)
-        frame = pd.read_csv(names_path, dtype = str, keep_default_na = False, header = "infer", sep = "\t")
-        from_gene_names = frame.loc[:, "from"]
-        to_gene_names = frame.loc[:, "to"]
-        self.map = {}
-        for from_gene_name, to_gene_name in zip(from_gene_names, to_gene_names):
-            if from_gene_name not in self.map:
-                self.map[from_gene_name] = set()
-            self.map[from_gene_name].add(to_gene_name)
+from curation import CurationStore
+from gmara import Namespace, NamespaceLinks
+from names_index import NamesIndex, find_sorted
+from normalization import Normalizer, read_sources
+from profiling import Profiler, add_profile_arguments, args_profiler
+
+class LoadedNamespaces:
+    def __init__(self, namespaces_dir):
+        self.namespaces_dir = namespaces_dir
+        self.namespaces = {}
+
+        index_path = f"{namespaces_dir}/index.bin"
+        if os.path.isfile(index_path):
+            self.index = NamesIndex(index_path)
+            namespace_names = self.index.namespace_names
+        else:
+            self.index = None
+            namespace_names = []
+            for namespace_path in os.listdir(f"{namespaces_dir}/names"):
+                base_path = os.path.basename(namespace_path)
+                parts = base_path.split(".")
+                if len(parts) == 2:
+                    namespace_names.append(parts[0])
+
+        for namespace_name in namespace_names:
+            self.namespaces[namespace_name] = Namespace(namespaces_dir, namespace_name, self.index)
+
+        sources_yaml = f"{namespaces_dir}/sources/sources.yaml"
+        if os.path.isfile(sources_yaml):
+            _sources_spec, self.normalizer = read_sources(sources_yaml)
+        else:
+            self.normalizer = Normalizer()
+
+        self.namespaces_links = {}
+
+    def namespace_map(self, from_namespace_name, to_namespace_name):
+        first_namespace_name, second_namespace_name = sorted((from_namespace_name, to_namespace_name))
+        namespace_links = self.namespaces_links.get((first_namespace_name, second_namespace_name))
+        if namespace_links is None:
+            namespace_links = self.namespaces_links[(first_namespace_name, second_namespace_name)] = NamespaceLinks(
+                self.namespaces_dir,
+                self.namespaces[first_namespace_name],
+                self.namespaces[second_namespace_name],
+                self.index,
+            )
+        return namespace_links.namespace_map(from_namespace_name, to_namespace_name)
+
+    def links_count(self):
+        return sum(len(namespace_links.first_ids) for namespace_links in self.namespaces_links.values())
 
 class Names:
-    def __init__(self, sources_dir, namespaces_dir):
+    def __init__(self, sources_dir, namespaces_dir, loaded_namespaces = None, curation = None):
         self.namespaces_dir = namespaces_dir
         self.sources_dir = sources_dir
-        self.namespaces = {}
-        self.gene_names = {}
-
-        for namespace_path in os.listdir(f"{namespaces_dir}/names"):
-            base_path = os.path.basename(namespace_path)
-            parts = base_path.split(".")
-            if len(parts) == 2:
-                namespace_name = parts[0]
-                self.namespaces[namespace_name] = Namespace(namespaces_dir, namespace_name)
-                self.gene_names[namespace_name] = set()
-
-        self.namespaces_maps = {}
-        for from_namespace_name in self.namespaces:
-            self.namespaces_maps[from_namespace_name] = {}
-            for to_namespace_name in self.namespaces:
-                self.namespaces_maps[from_namespace_name][to_namespace_name] = \
-                    NamespaceMap(namespaces_dir, from_namespace_name, to_namespace_name)
+        self.loaded_namespaces = loaded_namespaces or LoadedNamespaces(namespaces_dir)
+        self.curation = curation or CurationStore(namespaces_dir)
+        self.namespaces = self.loaded_namespaces.namespaces
+        self.normalizer = self.loaded_namespaces.normalizer
+        self.gene_names = { namespace_name: set() for namespace_name in self.namespaces }
 
     def collect_source(self, sources_spec):
         data_path = f"{self.sources_dir}/{sources_spec["data_file"]}"
@@ -70,63 +85,62 @@ class Names:
                 gene_names = frame.iloc[:, column].values
             else:
                 gene_names = frame.loc[:, column].values
-            gene_names = set([normalize_name(namespace_name, gene_name) for gene_name in gene_names if gene_name != ""])
-            self.gene_names[namespace_name].update(gene_names)
-
-    def verify_names(self):
-        for namespace_name, gene_names in self.gene_names.items():
-            print(f"Verify names {namespace_name} ...")
-
-            ignored_path = f"{self.namespaces_dir}/sources/{namespace_name}.Ignored.txt"
-            if os.path.isfile(ignored_path):
-                ignored_names = set([gene_name[:-1] for gene_name in open(ignored_path).readlines()])
-                gene_names -= ignored_names
-            else:
-                ignored_names = set()
-
-
-            missing_path = f"{self.namespaces_dir}/sources/{namespace_name}.Missing.txt"
-            if os.path.isfile(missing_path):
-                os.remove(missing_path)
-
-            missing_names = set()
-            namespace = self.namespaces[namespace_name]
-            for gene_name in sorted(gene_names):
-                if gene_name not in namespace.gene_names \
-                        and gene_name not in ignored_names \
-                        and gene_name not in missing_names:
-                    missing_names.add(gene_name)
-
-            if len(missing_names) > 0:
-                gene_names -= missing_names
-                with open(missing_path, "a") as file:
-                    for gene_name in sorted(missing_names):
+            self.gene_names[namespace_name].update(self.normalizer.normalize_names(namespace_name, gene_names[gene_names != ""]))
+
+    def names_count(self):
+        return sum(len(gene_names) for gene_names in self.gene_names.values())
+
+    def verify_names(self, *, append_missing = False):
+        missing_count = 0
+        with self.curation.transaction():
+            for namespace_name, gene_names in self.gene_names.items():
+                print(f"Verify names {namespace_name} ...")
+                gene_names -= self.curation.ignored_names(namespace_name)
+                if not append_missing:
+                    self.curation.remove_missing(namespace_name)
+
+                sorted_gene_names = np.array(sorted(gene_names), dtype = object)
+                gene_ids = find_sorted(self.namespaces[namespace_name].sorted_gene_names, sorted_gene_names)
+                missing_names = sorted_gene_names[gene_ids < 0]
+
+                missing_count += len(missing_names)
+                if len(missing_names) > 0:
+                    gene_names.difference_update(missing_names)
+                    for gene_name in missing_names:
                         print(f"The gene: '{gene_name}' is missing from the namespace: {namespace_name}")
-                        print(f"{gene_name}", file = file)
+                    self.curation.add_missing(namespace_name, missing_names)
+        return missing_count
 
     def complete_names(self):
         print("Complete names ...")
-        queue = []
+        is_visited = {}
+        frontiers = {}
+        for namespace_name, gene_names in self.gene_names.items():
+            sorted_gene_names = self.namespaces[namespace_name].sorted_gene_names
+            gene_ids = find_sorted(sorted_gene_names, sorted(gene_names))
+            frontiers[namespace_name] = np.unique(gene_ids[gene_ids >= 0])
+            is_visited[namespace_name] = np.zeros(len(sorted_gene_names), dtype = bool)
+            is_visited[namespace_name][frontiers[namespace_name]] = True
+
+        while any(len(frontier) > 0 for frontier in frontiers.values()):
+            reached_ids = { namespace_name: [np.empty(0, dtype = np.int64)] for namespace_name in self.gene_names }
+            for namespace_name, frontier in frontiers.items():
+                if len(frontier) == 0:
+                    continue
+                for other_namespace_name in self.namespaces:
+                    map_to_other_namespace = self.loaded_namespaces.namespace_map(namespace_name, other_namespace_name)
+                    _positions, other_gene_ids = map_to_other_namespace.translate_ids(frontier)
+                    reached_ids[other_namespace_name].append(other_gene_ids)
+
+            for namespace_name, namespace_reached_ids in reached_ids.items():
+                gene_ids = np.unique(np.concatenate(namespace_reached_ids))
+                gene_ids = gene_ids[gene_ids >= 0]
+                gene_ids = gene_ids[~is_visited[namespace_name][gene_ids]]
+                is_visited[namespace_name][gene_ids] = True
+                frontiers[namespace_name] = gene_ids
+
         for namespace_name, gene_names in self.gene_names.items():
-            for gene_name in gene_names:
-                self.complete_name(namespace_name, gene_name, queue, to_add = False)
-        while len(queue) != 0:
-            namespace_name, gene_name = queue.pop()
-            self.complete_name(namespace_name, gene_name, queue, to_add = True)
-
-    def complete_name(self, namespace_name, gene_name, queue, *, to_add):
-        if to_add:
-            gene_names = self.gene_names[namespace_name]
-            if gene_name in gene_names:
-                return
-            gene_names.add(gene_name)
-
-        for other_namespace_name, map_to_other_namespace in self.namespaces_maps[namespace_name].items():
-            other_namespace_gene_names = self.gene_names[other_namespace_name]
-            if gene_name in map_to_other_namespace.map:
-                for other_gene_name in map_to_other_namespace.map[gene_name]:
-                    if other_gene_name not in self.gene_names[other_namespace_name]:
-                        queue.append((other_namespace_name, other_gene_name))
+            gene_names.update(self.namespaces[namespace_name].sorted_gene_names[is_visited[namespace_name]])
 
     def write(self, names_dir):
         if os.path.exists(names_dir):
@@ -140,34 +154,48 @@ class Names:
                 for gene_name in sorted(namespace_gene_names):
                     print(gene_name, file=file)
 
-def normalize_name(namespace_name, name):
-    if namespace_name == "UCSC":
-        return name
-    parts = name.split(".")
-    if len(parts) == 2:
-        return parts[0]
-    else:
-        return name
-
-def main():
-    assert len(sys.argv) == 3, "Usage: compute_list.py species list"
-    species = sys.argv[1]
-    list_name = sys.argv[2]
-
+def compute_list(species, list_name, *, loaded_namespaces = None, append_missing = False, profiler = None):
+    profiler = profiler or Profiler()
     sources_yaml = f"genes/{species}/lists/{list_name}/sources/sources.yaml"
     with open(sources_yaml) as file:
         sources_spec = yaml.safe_load(file)
 
     sources_dir = f"genes/{species}/lists/{list_name}/sources"
     namespaces_dir = f"genes/{species}/namespaces"
-    names = Names(sources_dir, namespaces_dir)
+    with profiler.stage("load namespaces") as counts:
+        names = Names(sources_dir, namespaces_dir, loaded_namespaces)
+        counts["namespaces"] = len(names.namespaces)
+        counts["names"] = sum(len(namespace.sorted_gene_names) for namespace in names.namespaces.values())
     for source_spec in sources_spec:
-        names.collect_source(source_spec)
-    names.verify_names()
-    names.complete_names()
+        with profiler.stage(f"collect sources/{source_spec["data_file"]}") as counts:
+            names_count = names.names_count()
+            names.collect_source(source_spec)
+            counts["names"] = names.names_count() - names_count
+    with profiler.stage("verify names") as counts:
+        counts["missing"] = names.verify_names(append_missing = append_missing)
+        counts["names"] = names.names_count()
+    with profiler.stage("complete names") as counts:
+        names_count = names.names_count()
+        names.complete_names()
+        counts["added"] = names.names_count() - names_count
+        counts["names"] = names.names_count()
+        counts["links"] = names.loaded_namespaces.links_count()
+
+    names_dir = f"genes/{species}/lists/{list_name}/names"
+    with profiler.stage("write") as counts:
+        names.write(names_dir)
+        counts["files"] = len(names.gene_names)
+        counts["names"] = names.names_count()
 
-    names_dir = f"genes/{species}/namespaces/names"
-    names.write(names_dir)
+def main():
+    parser = argparse.ArgumentParser(description = "Compute the names of a list of genes of a species.")
+    add_profile_arguments(parser)
+    parser.add_argument("species")
+    parser.add_argument("list")
+    args = parser.parse_args()
+    profiler = args_profiler(args, f"genes/{args.species}/lists/{args.list}")
+    compute_list(args.species, args.list, profiler = profiler)
+    profiler.write()
 
 if __name__ == "__main__":
     main()
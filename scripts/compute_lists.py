@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import numpy as np
+import os
+import shutil
+import yaml
+
+from compute_list import LoadedNamespaces, Names
+from curation import CurationStore
+from gmara import MEMBERSHIP_FILE
+from names_index import find_sorted
+from profiling import Profiler, add_profile_arguments, args_profiler
+
+class ListsNames:
+    def __init__(self, lists_dir, list_names, namespaces_dir, loaded_namespaces = None, *, list_log = None):
+        self.lists_dir = lists_dir
+        self.list_names = list_names
+        self.loaded_namespaces = loaded_namespaces or LoadedNamespaces(namespaces_dir)
+        self.namespaces = self.loaded_namespaces.namespaces
+        self.list_log = list_log or (lambda list_name: contextlib.nullcontext())
+        self.curation = CurationStore(namespaces_dir)
+        self.lists_names = {
+            list_name: Names(f"{lists_dir}/{list_name}/sources", namespaces_dir, self.loaded_namespaces, self.curation)
+            for list_name in list_names
+        }
+        self.is_member = None
+
+    def collect_sources(self):
+        for list_name, names in self.lists_names.items():
+            with self.list_log(list_name):
+                with open(f"{self.lists_dir}/{list_name}/sources/sources.yaml") as file:
+                    sources_spec = yaml.safe_load(file)
+                for source_spec in sources_spec:
+                    names.collect_source(source_spec)
+
+    def names_count(self):
+        if self.is_member is None:
+            return sum(names.names_count() for names in self.lists_names.values())
+        return sum(int(np.count_nonzero(self.lists_members(namespace_name))) for namespace_name in self.namespaces)
+
+    def lists_members(self, namespace_name):
+        is_member = self.is_member[namespace_name]
+        bits = np.unpackbits(is_member.view(np.uint8).reshape(len(is_member), -1), axis = 1, bitorder = "little")
+        return bits[:, :len(self.list_names)].astype(bool)
+
+    def verify_names(self, *, append_missing = False):
+        missing_count = 0
+        with self.curation.transaction():
+            for list_index, (list_name, names) in enumerate(self.lists_names.items()):
+                with self.list_log(list_name):
+                    missing_count += names.verify_names(append_missing = append_missing or list_index > 0)
+        return missing_count
+
+    def complete_names(self):
+        print("Complete names ...", flush = True)
+        words_count = (len(self.list_names) + 63) // 64
+        self.is_member = {}
+        frontiers = {}
+        for namespace_name, namespace in self.namespaces.items():
+            sorted_gene_names = namespace.sorted_gene_names
+            is_member = self.is_member[namespace_name] = np.zeros((len(sorted_gene_names), words_count), dtype = "<u8")
+            for list_index, names in enumerate(self.lists_names.values()):
+                gene_ids = find_sorted(sorted_gene_names, sorted(names.gene_names[namespace_name]))
+                is_member[gene_ids[gene_ids >= 0], list_index // 64] |= np.uint64(1 << (list_index % 64))
+            gene_ids = np.flatnonzero(is_member.any(axis = 1))
+            frontiers[namespace_name] = (gene_ids, is_member[gene_ids])
+
+        while any(len(gene_ids) > 0 for gene_ids, _members in frontiers.values()):
+            reached = {
+                namespace_name: ([np.empty(0, dtype = np.int64)], [np.empty((0, words_count), dtype = "<u8")])
+                for namespace_name in self.namespaces
+            }
+            for namespace_name, (gene_ids, members) in frontiers.items():
+                if len(gene_ids) == 0:
+                    continue
+                for other_namespace_name in self.namespaces:
+                    map_to_other_namespace = self.loaded_namespaces.namespace_map(namespace_name, other_namespace_name)
+                    positions, other_gene_ids = map_to_other_namespace.translate_ids(gene_ids)
+                    reached[other_namespace_name][0].append(other_gene_ids)
+                    reached[other_namespace_name][1].append(members[positions])
+
+            for namespace_name, (reached_ids, reached_members) in reached.items():
+                gene_ids = np.concatenate(reached_ids)
+                members = np.concatenate(reached_members)
+                order = np.argsort(gene_ids, kind = "stable")
+                gene_ids = gene_ids[order]
+                members = members[order]
+                if len(gene_ids) > 0:
+                    starts = np.flatnonzero(np.diff(gene_ids, prepend = -1))
+                    gene_ids = gene_ids[starts]
+                    members = np.bitwise_or.reduceat(members, starts, axis = 0)
+                    members &= ~self.is_member[namespace_name][gene_ids]
+                is_reached = members.any(axis = 1)
+                gene_ids = gene_ids[is_reached]
+                members = members[is_reached]
+                self.is_member[namespace_name][gene_ids] |= members
+                frontiers[namespace_name] = (gene_ids, members)
+
+    def write(self):
+        lists_members = { namespace_name: self.lists_members(namespace_name) for namespace_name in self.namespaces }
+        for list_index, list_name in enumerate(self.list_names):
+            names_dir = f"{self.lists_dir}/{list_name}/names"
+            with self.list_log(list_name):
+                if os.path.exists(names_dir):
+                    shutil.rmtree(names_dir)
+                os.mkdir(names_dir)
+
+                for namespace_name, namespace in self.namespaces.items():
+                    print(f"Write names/{namespace_name}.tsv ...", flush = True)
+                    gene_names = namespace.sorted_gene_names[lists_members[namespace_name][:, list_index]]
+                    with open(f"{names_dir}/{namespace_name}.tsv", "w") as file:
+                        file.write("name\n")
+                        file.write("".join(f"{gene_name}\n" for gene_name in gene_names))
+
+    def write_membership(self):
+        membership_path = f"{self.lists_dir}/{MEMBERSHIP_FILE}"
+        print(f"Write {MEMBERSHIP_FILE} ...", flush = True)
+        arrays = dict(list_names = encode_names(self.list_names))
+        for namespace_name, namespace in self.namespaces.items():
+            gene_ids, list_ids = np.nonzero(self.lists_members(namespace_name))
+            member_ids = np.flatnonzero(self.is_member[namespace_name].any(axis = 1))
+            arrays[f"{namespace_name}.names"] = encode_names(namespace.sorted_gene_names[member_ids])
+            arrays[f"{namespace_name}.offsets"] = np.searchsorted(gene_ids, np.append(member_ids, len(namespace.sorted_gene_names)))
+            arrays[f"{namespace_name}.lists"] = list_ids.astype(np.int32)
+
+        temporary_path = f"{membership_path}.tmp"
+        with open(temporary_path, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(temporary_path, membership_path)
+
+def encode_names(gene_names):
+    return np.frombuffer("".join(f"{gene_name}\n" for gene_name in gene_names).encode(), dtype = np.uint8)
+
+def find_lists(species):
+    lists_dir = f"genes/{species}/lists"
+    if not os.path.isdir(lists_dir):
+        return []
+    return sorted(
+        list_name
+        for list_name in os.listdir(lists_dir)
+        if os.path.isfile(f"{lists_dir}/{list_name}/sources/sources.yaml")
+    )
+
+def compute_lists(
+    species, list_names = None, *, loaded_namespaces = None, append_missing = False, list_log = None, profiler = None
+):
+    profiler = profiler or Profiler()
+    list_names = find_lists(species) if list_names is None else list_names
+    lists_dir = f"genes/{species}/lists"
+    namespaces_dir = f"genes/{species}/namespaces"
+    with profiler.stage("load namespaces") as counts:
+        lists_names = ListsNames(lists_dir, list_names, namespaces_dir, loaded_namespaces, list_log = list_log)
+        counts["lists"] = len(list_names)
+        counts["namespaces"] = len(lists_names.namespaces)
+        counts["names"] = sum(len(namespace.sorted_gene_names) for namespace in lists_names.namespaces.values())
+    with profiler.stage("collect sources") as counts:
+        lists_names.collect_sources()
+        counts["names"] = lists_names.names_count()
+    with profiler.stage("verify names") as counts:
+        counts["missing"] = lists_names.verify_names(append_missing = append_missing)
+        counts["names"] = lists_names.names_count()
+    with profiler.stage("complete names") as counts:
+        names_count = lists_names.names_count()
+        lists_names.complete_names()
+        counts["added"] = lists_names.names_count() - names_count
+        counts["names"] = lists_names.names_count()
+        counts["links"] = lists_names.loaded_namespaces.links_count()
+    with profiler.stage("write") as counts:
+        lists_names.write()
+        lists_names.write_membership()
+        counts["files"] = len(list_names) * len(lists_names.namespaces)
+        counts["names"] = lists_names.names_count()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Compute the names of all the lists of genes of a species in one pass.")
+    add_profile_arguments(parser)
+    parser.add_argument("species")
+    parser.add_argument("lists", nargs = "*", help = "the lists to compute (default: all of them)")
+    args = parser.parse_args()
+    profiler = args_profiler(args, f"genes/{args.species}/lists")
+    compute_lists(args.species, args.lists or None, profiler = profiler)
+    profiler.write()
+
+if __name__ == "__main__":
+    main()
@@ -1,234 +1,737 @@
 #!/usr/bin/env python3
 
+import argparse
+import hashlib
+import json
+import numpy as np
 import os.path
 import pandas as pd
-import re
 import shutil
-import sys
-import yaml
 
-class Gene:
-    def __init__(self, name, is_alternative):
-        self.name = name
-        self.is_alternative = is_alternative
-        self.links = set()
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from names_index import NamesIndex, NamesIndexWriter
+from normalization import Normalizer, read_sources
+from profiling import Profiler, add_profile_arguments, args_profiler
+
+WRITE_BLOCK_SIZE = 1 << 16
+
+MAX_COMPONENT_SIZE = 10_000
+
+OVERSIZED_COMPONENTS_REPORTED = 10
+
+HELPER_SCRIPTS = ["normalization.py", "names_index.py", "gmara.py", "profiling.py", "curation.py"]
+
+LITERALS = b"\tTrue\n\tFalse\n"
+TAB_START, TAB_LENGTH = 0, 1
+TRUE_START, TRUE_LENGTH = 0, 6
+FALSE_START, FALSE_LENGTH = 6, 7
+
+CANONICAL_NAMESPACES = None
+
+WRITTEN_NAMESPACES = None
+
+CHANGES_COLUMNS = ["change", "from_namespace", "to_namespace", "from", "to"]
 
 class Namespace:
-    def __init__(self, name):
+    def __init__(self, name, index):
         self.name = name
-        self.genes = {}
+        self.index = index
+        self.gene_ids = {}
 
 class Namespaces:
-    def __init__(self, sources_dir):
+    def __init__(self, sources_dir, normalizer = None):
         self.sources_dir = sources_dir
+        self.normalizer = normalizer or Normalizer()
         self.namespaces = {}
+        self.gene_names = []
+        self.gene_namespaces = array("i")
+        self.is_alternative = bytearray()
+        self.first_links = []
+        self.second_links = []
+        self.rows_count = 0
 
-    def collect_source(self, sources_spec):
+    def counts(self):
+        return dict(
+            rows = self.rows_count,
+            names = len(self.gene_names),
+            links = sum(len(first_links) for first_links in self.first_links),
+        )
+
+    def collect_source(self, sources_spec, *, cache_dir = None):
         data_path = f"{self.sources_dir}/{sources_spec["data_file"]}"
         has_header = sources_spec.get("has_header", True)
+        chunk_size = sources_spec.get("chunk_size")
         assert os.path.isfile(data_path), f"not a file: {data_path}"
-        frame = pd.read_csv(
-            data_path,
-            dtype = str,
-            keep_default_na = False,
-            header="infer" if has_header else None,
-            sep = "," if data_path.endswith(".csv") else "\t",
-            comment = "#",
-        )
 
+        if cache_dir is not None:
+            cache_path = f"{cache_dir}/{sources_spec["data_file"]}.npz"
+            cache_key = source_cache_key(data_path, sources_spec, self.normalizer)
+            contribution = load_contribution(cache_path, cache_key)
+            if contribution is None:
+                source = Namespaces(self.sources_dir, self.normalizer)
+                source.collect_source(sources_spec)
+                contribution = source.contribution()
+                save_contribution(cache_path, cache_key, contribution)
+            else:
+                print(f"Reuse cached sources/{sources_spec["data_file"]} ...", flush = True)
+            self.add_contribution(contribution)
+            return
+
+        for frame in read_frames(data_path, has_header = has_header, chunk_size = chunk_size, comment = "#"):
+            if chunk_size is None:
+                self.collect_frame(sources_spec, frame, is_verbose = True)
+            else:
+                print(f"Collect sources/{sources_spec["data_file"]} / rows {frame.index[0]} - {frame.index[-1]} ...", flush = True)
+                self.collect_frame(sources_spec, frame, is_verbose = False)
+
+    def collect_frame(self, sources_spec, frame, *, is_verbose):
+        self.rows_count += len(frame)
         columns = []
         for column, column_spec in sources_spec["columns"].items():
             namespace_name = column_spec["namespace"]
             is_alternative = column_spec.get("is_alternative", False)
+            if is_verbose:
+                print(f"Collect sources/{sources_spec["data_file"]} / {len(columns)} -> {namespace_name} ...", flush = True)
             if isinstance(column, int):
-                data = frame.iloc[:, column].values
+                data = frame.iloc[:, column]
             else:
-                data = frame.loc[:, column].values
-            columns.append((namespace_name, is_alternative, data))
+                data = frame.loc[:, column]
+            gene_names = self.normalizer.split_names(namespace_name, data)
+            gene_ids = self.add_names(namespace_name, is_alternative, gene_names.values)
+            columns.append((namespace_name, pd.Series(gene_ids, index = gene_names.index)))
 
         for first_column in range(len(columns)):
-            first_namespace_name, first_is_alternative, first_gene_names = columns[first_column]
-            print(f"Collect sources/{sources_spec["data_file"]} / {first_column} -> {first_namespace_name} ...", flush = True)
-            for row in range(frame.shape[0]):
-                self.add_names(first_namespace_name, first_is_alternative, split_names(first_namespace_name, first_gene_names[row]))
+            first_namespace_name, first_gene_ids = columns[first_column]
             for second_column in range(first_column):
-                second_namespace_name, second_is_alternative, second_gene_names = columns[second_column]
-                print(f"Collect sources/{sources_spec["data_file"]} / {first_column} -> {first_namespace_name} / {second_column} -> {second_namespace_name} ...", flush = True)
-                for row in range(frame.shape[0]):
-                    self.link_names(
-                        first_namespace_name,
-                        split_names(first_namespace_name, first_gene_names[row]),
-                        second_namespace_name,
-                        split_names(second_namespace_name, second_gene_names[row]),
-                    )
+                second_namespace_name, second_gene_ids = columns[second_column]
+                if is_verbose:
+                    print(f"Collect sources/{sources_spec["data_file"]} / {first_column} -> {first_namespace_name} / {second_column} -> {second_namespace_name} ...", flush = True)
+                links = pd.merge(
+                    first_gene_ids.rename("first"),
+                    second_gene_ids.rename("second"),
+                    left_index = True,
+                    right_index = True,
+                )
+                self.link_ids(links["first"].values, links["second"].values)
+
+    def contribution(self):
+        return dict(
+            namespace_names = np.array(list(self.namespaces), dtype = str),
+            gene_names = np.frombuffer("\n".join(self.gene_names).encode(), dtype = np.uint8),
+            gene_namespaces = np.array(self.gene_namespaces, dtype = np.int32),
+            is_alternative = np.frombuffer(self.is_alternative, dtype = bool),
+            first_links = np.concatenate([np.empty(0, dtype = np.int32), *self.first_links]),
+            second_links = np.concatenate([np.empty(0, dtype = np.int32), *self.second_links]),
+            rows_count = np.int64(self.rows_count),
+        )
+
+    def add_contribution(self, contribution):
+        gene_namespaces = contribution["gene_namespaces"]
+        gene_names = np.empty(len(gene_namespaces), dtype = object)
+        if len(gene_names) > 0:
+            gene_names[:] = contribution["gene_names"].tobytes().decode().split("\n")
+        is_alternative = contribution["is_alternative"]
+        gene_ids = np.empty(len(gene_names), dtype = np.int64)
+        for namespace_index, namespace_name in enumerate(contribution["namespace_names"]):
+            for is_namespace_alternative in (False, True):
+                is_added = (gene_namespaces == namespace_index) & (is_alternative == is_namespace_alternative)
+                gene_ids[is_added] = self.add_names(str(namespace_name), is_namespace_alternative, gene_names[is_added])
+        self.link_ids(gene_ids[contribution["first_links"]], gene_ids[contribution["second_links"]])
+        self.rows_count += int(contribution["rows_count"])
 
     def add_names(self, namespace_name, is_alternative, gene_names):
         if namespace_name not in self.namespaces:
-            self.namespaces[namespace_name] = Namespace(namespace_name)
+            self.namespaces[namespace_name] = Namespace(namespace_name, len(self.namespaces))
         namespace = self.namespaces[namespace_name]
-        for gene_name in gene_names:
-            if gene_name != "":
-                if gene_name not in namespace.genes:
-                    namespace.genes[gene_name] = Gene(gene_name, is_alternative)
-                elif is_alternative:
-                    namespace.genes[gene_name].is_alternative = True
-
-    def link_names(self, first_namespace_name, first_gene_names, second_namespace_name, second_gene_names):
-        first_namespace = self.namespaces[first_namespace_name]
-        second_namespace = self.namespaces[second_namespace_name]
-        for first_gene_name in first_gene_names:
-            if first_gene_name != "":
-                for second_gene_name in second_gene_names:
-                    if second_gene_name != "":
-                        first_namespace.genes[first_gene_name].links.add((second_namespace_name, second_gene_name))
-                        second_namespace.genes[second_gene_name].links.add((first_namespace_name, first_gene_name))
+        gene_codes, unique_gene_names = pd.factorize(np.asarray(gene_names, dtype = object))
+        unique_gene_ids = np.empty(len(unique_gene_names) + 1, dtype = np.int64)
+        unique_gene_ids[-1] = -1
+        for index, gene_name in enumerate(unique_gene_names):
+            gene_id = namespace.gene_ids.get(gene_name)
+            if gene_name == "":
+                gene_id = -1
+            elif gene_id is None:
+                gene_id = namespace.gene_ids[gene_name] = len(self.gene_names)
+                self.gene_names.append(gene_name)
+                self.gene_namespaces.append(namespace.index)
+                self.is_alternative.append(is_alternative)
+            elif is_alternative:
+                self.is_alternative[gene_id] = True
+            unique_gene_ids[index] = gene_id
+        return unique_gene_ids[gene_codes]
+
+    def link_ids(self, first_gene_ids, second_gene_ids):
+        is_linked = (first_gene_ids >= 0) & (second_gene_ids >= 0)
+        self.first_links.append(first_gene_ids[is_linked].astype(np.int32))
+        self.second_links.append(second_gene_ids[is_linked].astype(np.int32))
 
     def collect_extra(self):
-        for namespace_name in self.namespaces:
+        for namespace_name in list(self.namespaces):
             self.collect_extra_namespace(namespace_name)
-            for other_namespace_name in self.namespaces:
+            for other_namespace_name in list(self.namespaces):
                 self.collect_extra_namespaces(namespace_name, other_namespace_name)
 
     def collect_extra_namespace(self, namespace_name):
-        namespace = self.namespaces[namespace_name]
         extra_path = f"{self.sources_dir}/{namespace_name}.Extra.tsv"
         if os.path.isfile(extra_path):
             print(f"Collect sources/{namespace_name}.Extra.tsv ...")
-            frame = pd.read_csv(
-                extra_path,
-                dtype = str,
-                keep_default_na = False,
-                header=None,
-                sep = "\t",
-            )
-            first_gene_names = frame.iloc[:, 0].values
-            second_gene_names = frame.iloc[:, 1].values
-            self.add_names(namespace_name, True, first_gene_names)
-            self.add_names(namespace_name, False, second_gene_names)
-            self.link_names(namespace_name, first_gene_names, namespace_name, second_gene_names)
+            frame, = read_frames(extra_path, has_header = False)
+            first_gene_ids = self.add_names(namespace_name, True, frame.iloc[:, 0].values)
+            second_gene_ids = self.add_names(namespace_name, False, frame.iloc[:, 1].values)
+            self.link_ids(first_gene_ids, second_gene_ids)
 
     def collect_extra_namespaces(self, first_namespace_name, second_namespace_name):
-        first_namespace = self.namespaces[first_namespace_name]
-        second_namespace = self.namespaces[second_namespace_name]
         extra_path = f"{self.sources_dir}/{first_namespace_name}.{second_namespace_name}.Extra.tsv"
         if os.path.isfile(extra_path):
             print(f"Collect sources/{first_namespace_name}.{second_namespace_name}.Extra.tsv ...")
-            frame = pd.read_csv(
-                extra_path,
-                dtype = str,
-                keep_default_na = False,
-                header=None,
-                sep = "\t",
-            )
-            first_gene_names = frame.iloc[:, 0].values
-            second_gene_names = frame.iloc[:, 1].values
-            self.add_names(first_namespace_name, True, first_gene_names)
-            self.add_names(second_namespace_name, False, second_gene_names)
-            self.link_names(first_namespace_name, first_gene_names, second_namespace_name, second_gene_names)
-
-    def complete_links(self):
-        for namespace_name in self.namespaces:
-            print(f"Complete links {namespace_name} ...", flush = True)
-            for gene_name in self.namespaces[namespace_name].genes:
-                self.complete_name_links(namespace_name, gene_name)
-
-    def complete_name_links(self, from_namespace_name, from_gene_name):
-        from_gene = self.namespaces[from_namespace_name].genes[from_gene_name]
-        from_links = from_gene.links
-        from_is_alternative = from_gene.is_alternative
-        queue = list(from_gene.links)
-        while len(queue) > 0:
-            link = queue.pop()
-            if link not in from_links:
-                to_namespace_name, to_gene_name = link
-                to_gene = self.namespaces[to_namespace_name].genes[to_gene_name]
-                if from_is_alternative or link_namespace_name != namespace_name:
-                    from_links.add(link)
-                    queue.extend(to_gene.links)
-
-    def ensure_canonical(self):
-        for namespace_name in self.namespaces:
-            print(f"Ensure canonical {namespace_name} ...", flush = True)
-            for gene_name in self.namespaces[namespace_name].genes:
-                self.ensure_canonical_gene(namespace_name, gene_name)
-
-    def ensure_canonical_gene(self, namespace_name, gene_name):
-        gene = self.namespaces[namespace_name].genes[gene_name]
-        if not gene.is_alternative:
+            frame, = read_frames(extra_path, has_header = False)
+            first_gene_ids = self.add_names(first_namespace_name, True, frame.iloc[:, 0].values)
+            second_gene_ids = self.add_names(second_namespace_name, False, frame.iloc[:, 1].values)
+            self.link_ids(first_gene_ids, second_gene_ids)
+
+    def complete_links(self, *, max_component_size = MAX_COMPONENT_SIZE):
+        print("Complete links ...", flush = True)
+        genes_count = len(self.gene_names)
+        first_ids = np.concatenate([np.empty(0, dtype = np.int32), *self.first_links], dtype = np.int64)
+        second_ids = np.concatenate([np.empty(0, dtype = np.int32), *self.second_links], dtype = np.int64)
+        keys = np.unique(np.concatenate([
+            first_ids * genes_count + second_ids,
+            second_ids * genes_count + first_ids,
+        ]))
+        self.first_links = []
+        self.second_links = []
+        self.link_sources = (keys // genes_count).astype(np.int32)
+        self.link_targets = (keys % genes_count).astype(np.int32)
+
+        gene_namespaces = np.frombuffer(self.gene_namespaces, dtype = np.int32)
+        self.component_labels = label_components(genes_count, self.link_sources, self.link_targets)
+        self.component_sizes = np.bincount(self.component_labels)
+        print(f"Complete links: {np.count_nonzero(self.component_sizes)} components, largest: {self.component_sizes.max(initial = 0)} names", flush = True)
+        self.report_oversized_components(max_component_size)
+
+        self.namespace_labels = {}
+        for namespace in self.namespaces.values():
+            print(f"Complete links {namespace.name} ...", flush = True)
+            is_other = gene_namespaces != namespace.index
+            is_other_link = is_other[self.link_sources] & is_other[self.link_targets]
+            labels = label_components(genes_count, self.link_sources[is_other_link], self.link_targets[is_other_link])
+            labels[~is_other] = -1
+            self.namespace_labels[namespace.index] = labels
+
+    def report_oversized_components(self, max_component_size):
+        if max_component_size is None:
+            self.is_oversized = np.zeros(len(self.component_sizes), dtype = bool)
+            return
+        self.is_oversized = self.component_sizes > max_component_size
+        oversized_labels = np.flatnonzero(self.is_oversized)
+        if len(oversized_labels) == 0:
             return
-        first_gene_name = gene_name
-        for link in gene.links:
-            link_namespace_name, link_gene_name = link
-            if link_namespace_name == namespace_name:
-                link_gene = self.namespaces[namespace_name].genes[link_gene_name]
-                if not link_gene.is_alternative:
-                    return
-                if link_gene_name < first_gene_name:
-                    first_gene_name = link_gene_name
-        if first_gene_name == gene_name:
-            gene.is_alternative = False
-
-    def write(self, names_dir):
+        print(
+            f"WARNING: {len(oversized_labels)} components have more than {max_component_size} names, "
+            "their names will only be mapped to the canonical names they are directly linked to:",
+            flush = True,
+        )
+        oversized_labels = oversized_labels[np.argsort(-self.component_sizes[oversized_labels], kind = "stable")]
+        first_gene_ids = np.full(len(self.component_sizes), len(self.gene_names))
+        np.minimum.at(first_gene_ids, self.component_labels, np.arange(len(self.gene_names)))
+        namespace_names = { namespace.index: namespace.name for namespace in self.namespaces.values() }
+        for label in oversized_labels[:OVERSIZED_COMPONENTS_REPORTED]:
+            gene_id = first_gene_ids[label]
+            namespace_name = namespace_names[self.gene_namespaces[gene_id]]
+            print(f"- {self.component_sizes[label]} names, including the {namespace_name}: {self.gene_names[gene_id]}", flush = True)
+        if len(oversized_labels) > OVERSIZED_COMPONENTS_REPORTED:
+            print(f"- and {len(oversized_labels) - OVERSIZED_COMPONENTS_REPORTED} more", flush = True)
+
+    def ensure_canonical(self, *, jobs = 1):
+        global CANONICAL_NAMESPACES
+
+        print("Ensure canonical ...", flush = True)
+        shards_count = max(1, min(jobs, np.count_nonzero(self.component_sizes)))
+        CANONICAL_NAMESPACES = (self, self.gene_ranks(), shards_count)
+        try:
+            if shards_count > 1:
+                with ProcessPoolExecutor(max_workers = shards_count, mp_context = get_context("fork")) as executor:
+                    shards = list(executor.map(ensure_shard_canonical, range(shards_count)))
+            else:
+                shards = [ensure_shard_canonical(0)]
+        finally:
+            CANONICAL_NAMESPACES = None
+
+        self.is_canonical = np.empty(len(self.gene_names), dtype = bool)
+        for gene_ids, is_canonical in shards:
+            self.is_canonical[gene_ids] = is_canonical
+
+    def shard_canonical(self, gene_ranks, shard, shards_count):
+        if shards_count == 1:
+            gene_ids = np.arange(len(self.gene_names))
+        else:
+            gene_ids = np.flatnonzero(self.component_labels % shards_count == shard)
+        gene_namespaces = np.frombuffer(self.gene_namespaces, dtype = np.int32)
+        group_keys = self.component_labels[gene_ids].astype(np.int64) * len(self.namespaces) + gene_namespaces[gene_ids]
+        order = np.argsort(group_keys * len(self.gene_names) + gene_ranks[gene_ids])
+        gene_ids = gene_ids[order]
+        group_keys = group_keys[order]
+
+        group_starts = np.flatnonzero(np.diff(group_keys, prepend = -1) != 0)
+        is_canonical = ~np.frombuffer(self.is_alternative, dtype = bool)[gene_ids]
+        if len(gene_ids) > 0:
+            group_has_canonical = np.logical_or.reduceat(is_canonical, group_starts)
+            is_canonical[group_starts[~group_has_canonical]] = True
+        return gene_ids, is_canonical
+
+    def namespace_links(self, namespace):
+        is_alternative = np.frombuffer(self.is_alternative, dtype = bool)
+        gene_namespaces = np.frombuffer(self.gene_namespaces, dtype = np.int32)
+        is_source = gene_namespaces == namespace.index
+        is_target = self.is_canonical
+        namespace_labels = self.namespace_labels[namespace.index]
+        is_capped = self.is_oversized[self.component_labels]
+
+        alternative_ids = np.flatnonzero(is_source & is_alternative & ~is_capped)
+        is_direct = is_source[self.link_sources] & ~is_alternative[self.link_sources] & ~is_capped[self.link_sources]
+        is_same = is_direct & is_target[self.link_targets] & (gene_namespaces[self.link_targets] == namespace.index)
+        is_other = is_direct & (namespace_labels[self.link_targets] >= 0)
+        is_capped_link = is_source[self.link_sources] & is_capped[self.link_sources] & is_target[self.link_targets]
+        canonical_labels = np.unique(
+            self.link_sources[is_other].astype(np.int64) * len(self.gene_names)
+            + namespace_labels[self.link_targets[is_other]]
+        )
+
+        all_sources = [self.link_sources[is_same], self.link_sources[is_capped_link]]
+        all_targets = [self.link_targets[is_same], self.link_targets[is_capped_link]]
+        for group_sources, group_labels, group_member_labels in (
+            (alternative_ids, self.component_labels[alternative_ids], self.component_labels),
+            (canonical_labels // len(self.gene_names), canonical_labels % len(self.gene_names), namespace_labels),
+        ):
+            members = np.flatnonzero(is_target & (group_member_labels >= 0))
+            members = members[np.argsort(group_member_labels[members], kind = "stable")]
+            member_offsets = np.searchsorted(group_member_labels[members], np.arange(len(self.gene_names) + 1))
+            starts = member_offsets[group_labels]
+            counts = member_offsets[group_labels + 1] - starts
+            offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            all_sources.append(np.repeat(group_sources, counts))
+            all_targets.append(members[offsets])
+
+        link_sources = np.concatenate(all_sources)
+        link_targets = np.concatenate(all_targets)
+        is_other = link_sources != link_targets
+        return link_sources[is_other], link_targets[is_other]
+
+    def gene_ranks(self):
+        gene_ranks = np.empty(len(self.gene_names), dtype = np.int64)
+        for namespace in self.namespaces.values():
+            gene_ids = self.sorted_gene_ids(namespace)
+            gene_ranks[gene_ids] = np.arange(len(gene_ids))
+        return gene_ranks
+
+    def sorted_gene_ids(self, namespace):
+        return np.fromiter(
+            (namespace.gene_ids[gene_name] for gene_name in sorted(namespace.gene_ids)),
+            dtype = np.int64,
+            count = len(namespace.gene_ids),
+        )
+
+    def write(self, names_dir, index_path, *, jobs = 1, changes_path = None, only_changed = False):
+        global WRITTEN_NAMESPACES
+
+        temporary_dir = f"{names_dir}.tmp"
+        if os.path.exists(temporary_dir):
+            shutil.rmtree(temporary_dir)
+        os.mkdir(temporary_dir)
+
+        gene_ranks = self.gene_ranks()
+        gene_namespaces = np.frombuffer(self.gene_namespaces, dtype = np.int32)
+        order = np.argsort(gene_namespaces.astype(np.int64) * len(self.gene_names) + gene_ranks)
+        namespace_offsets = np.searchsorted(gene_namespaces[order], np.arange(len(self.namespaces) + 1))
+        namespaces_gene_ids = [
+            order[namespace_offsets[namespace.index]:namespace_offsets[namespace.index + 1]]
+            for namespace in self.namespaces.values()
+        ]
+
+        gene_names = np.array(self.gene_names, dtype = object)
+        if os.path.isfile(index_path):
+            previous_names = PreviousNames(
+                index_path,
+                names_dir,
+                { namespace.name: gene_names[namespaces_gene_ids[namespace.index]] for namespace in self.namespaces.values() },
+            )
+        else:
+            previous_names = None
+
+        WRITTEN_NAMESPACES = (
+            self, encode_names(self.gene_names), gene_ranks, namespaces_gene_ids, previous_names, only_changed
+        )
+        try:
+            if jobs > 1 and len(self.namespaces) > 1:
+                with ProcessPoolExecutor(max_workers = min(jobs, len(self.namespaces)), mp_context = get_context("fork")) as executor:
+                    futures = [
+                        executor.submit(write_namespace_files, namespace.name, temporary_dir)
+                        for namespace in self.namespaces.values()
+                    ]
+                    namespaces_files = [future.result() for future in futures]
+            else:
+                namespaces_files = [
+                    write_namespace_files(namespace.name, temporary_dir)
+                    for namespace in self.namespaces.values()
+                ]
+        finally:
+            WRITTEN_NAMESPACES = None
+
+        index = NamesIndexWriter(index_path)
+        links_count = 0
+        self.written_files_count = 0
+        changes = []
+        for namespace, (is_canonical, namespaces_links, namespace_changes, is_written) \
+                in zip(self.namespaces.values(), namespaces_files):
+            file_names = [f"{namespace.name}.tsv"] + [f"{namespace.name}.{namespace2.name}.tsv" for namespace2 in self.namespaces.values()]
+            for file_name, is_file_written in zip(file_names, is_written):
+                print(f"{"Write" if is_file_written else "Keep"} names/{file_name} ...", flush = True)
+            self.written_files_count += sum(is_written)
+            changes += namespace_changes
+
+            gene_ids = namespaces_gene_ids[namespace.index]
+            index.add_namespace(namespace.name, gene_names[gene_ids], is_canonical)
+            for namespace2, (from_gene_ranks, to_gene_ranks) in zip(self.namespaces.values(), namespaces_links):
+                links_count += len(from_gene_ranks)
+                index.add_links(namespace.name, namespace2.name, len(gene_ids), from_gene_ranks, to_gene_ranks)
+
+        self.changes_count = None
+        if changes_path is not None:
+            if previous_names is None:
+                if os.path.exists(changes_path):
+                    os.remove(changes_path)
+            else:
+                changes += previous_names.removed_namespaces_changes()
+                changes = pd.concat(changes, ignore_index = True)
+                self.changes_count = len(changes)
+                print(f"Write {os.path.basename(changes_path)} ...", flush = True)
+                changes.to_csv(changes_path, sep = "\t", index = False)
+
+        old_dir = f"{names_dir}.old"
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
         if os.path.exists(names_dir):
-            shutil.rmtree(names_dir)
-        os.mkdir(names_dir)
-
-        for namespace_name in self.namespaces:
-            self.write_namespace(namespace_name, names_dir)
-            for namespace2_name in self.namespaces:
-                self.write_namespaces(namespace_name, namespace2_name, names_dir)
-
-    def write_namespace(self, namespace_name, names_dir):
-        print(f"Write names/{namespace_name}.tsv ...", flush = True)
-        with open(f"{names_dir}/{namespace_name}.tsv", "w") as file:
-            print("name\tis_canonical", file=file)
-            genes = self.namespaces[namespace_name].genes
-            for gene_name, gene in sorted(genes.items()):
-                print(f"{gene_name}\t{not gene.is_alternative}", file=file)
-
-    def write_namespaces(self, namespace1_name, namespace2_name, names_dir):
-        print(f"Write names/{namespace1_name}.{namespace2_name}.tsv ...", flush = True)
-        with open(f"{names_dir}/{namespace1_name}.{namespace2_name}.tsv", "w") as file:
-            print("from\tto", file=file)
-            genes1 = self.namespaces[namespace1_name].genes
-            for gene_name1, gene_data1 in sorted(genes1.items()):
-                for link in gene_data1.links:
-                    link_namespace_name, link_gene_name = link
-                    if link_namespace_name == namespace2_name:
-                        link_gene = self.namespaces[link_namespace_name].genes[link_gene_name]
-                        if not link_gene.is_alternative:
-                            print(f"{gene_name1}\t{link_gene_name}", file=file)
-
-def split_names(namespace_name, names):
-    return [normalize_name(namespace_name, name) for name in re.split(r"[| ,;\t]", names)]
-
-def normalize_name(namespace_name, name):
-    if namespace_name == "UCSC":
-        return name
-    parts = name.split(".")
-    if len(parts) == 2:
-        return parts[0]
-    else:
-        return name
+            os.rename(names_dir, old_dir)
+        os.rename(temporary_dir, names_dir)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
 
-def main():
-    assert len(sys.argv) == 2, "Usage: compute_namespaces.py species"
-    species = sys.argv[1]
+        index.write()
+        return links_count
+
+    def write_namespace_files(self, namespace, encoded_names, gene_ranks, gene_ids, names_dir, previous_names, only_changed):
+        buffer, name_starts, name_lengths = encoded_names
+        gene_namespaces = np.frombuffer(self.gene_namespaces, dtype = np.int32)
+        is_canonical = self.is_canonical[gene_ids]
+
+        changes = []
+        is_written = []
+        if previous_names is not None:
+            changes.append(previous_names.names_changes(namespace.name, is_canonical))
+        file_name = f"{namespace.name}.tsv"
+        is_kept = only_changed and previous_names is not None and len(changes[-1]) == 0 \
+            and previous_names.keep_file(file_name, names_dir)
+        if not is_kept:
+            write_rows(
+                f"{names_dir}/{file_name}",
+                "name\tis_canonical\n",
+                buffer,
+                [name_starts[gene_ids], np.where(is_canonical, TRUE_START, FALSE_START)],
+                [name_lengths[gene_ids] - 1, np.where(is_canonical, TRUE_LENGTH, FALSE_LENGTH)],
+            )
+        is_written.append(not is_kept)
+
+        link_sources, link_targets = self.namespace_links(namespace)
+        genes_count = len(self.gene_names)
+        order = np.argsort(
+            (gene_namespaces[link_targets].astype(np.int64) * genes_count + gene_ranks[link_sources]) * genes_count
+            + gene_ranks[link_targets]
+        )
+        link_sources = link_sources[order]
+        link_targets = link_targets[order]
+        namespace_offsets = np.searchsorted(gene_namespaces[link_targets], np.arange(len(self.namespaces) + 1))
 
+        namespaces_links = []
+        for namespace2 in self.namespaces.values():
+            sources = link_sources[namespace_offsets[namespace2.index]:namespace_offsets[namespace2.index + 1]]
+            targets = link_targets[namespace_offsets[namespace2.index]:namespace_offsets[namespace2.index + 1]]
+            from_gene_ranks = gene_ranks[sources].astype(np.int32)
+            to_gene_ranks = gene_ranks[targets].astype(np.int32)
+            namespaces_links.append((from_gene_ranks, to_gene_ranks))
+
+            if previous_names is not None:
+                changes.append(previous_names.links_changes(namespace.name, namespace2.name, from_gene_ranks, to_gene_ranks))
+            file_name = f"{namespace.name}.{namespace2.name}.tsv"
+            is_kept = only_changed and previous_names is not None and len(changes[-1]) == 0 \
+                and previous_names.keep_file(file_name, names_dir)
+            if not is_kept:
+                write_rows(
+                    f"{names_dir}/{file_name}",
+                    "from\tto\n",
+                    buffer,
+                    [name_starts[sources], np.full(len(sources), TAB_START), name_starts[targets]],
+                    [name_lengths[sources] - 1, np.full(len(sources), TAB_LENGTH), name_lengths[targets]],
+                )
+            is_written.append(not is_kept)
+
+        return is_canonical, namespaces_links, changes, is_written
+
+class PreviousNames:
+    def __init__(self, index_path, names_dir, namespaces_gene_names):
+        self.index_path = index_path
+        self.names_dir = names_dir
+        self.index = NamesIndex(index_path)
+        self.namespaces = {}
+        for namespace_name, gene_names in namespaces_gene_names.items():
+            if namespace_name in self.index.namespace_names:
+                previous_gene_names = self.index.gene_names(namespace_name)
+                previous_is_canonical = self.index.is_canonical(namespace_name)
+            else:
+                previous_gene_names = np.empty(0, dtype = object)
+                previous_is_canonical = np.empty(0, dtype = bool)
+            union_ids = pd.Index(gene_names).get_indexer(previous_gene_names)
+            is_removed = union_ids < 0
+            union_ids[is_removed] = len(gene_names) + np.arange(np.count_nonzero(is_removed))
+            union_names = np.concatenate([gene_names, previous_gene_names[is_removed]])
+            self.namespaces[namespace_name] = (union_names, union_ids, previous_is_canonical)
+
+    def names_changes(self, namespace_name, is_canonical):
+        union_names, union_ids, previous_is_canonical = self.namespaces[namespace_name]
+        is_current = np.arange(len(union_names)) < len(is_canonical)
+        is_previous = np.zeros(len(union_names), dtype = bool)
+        is_previous[union_ids] = True
+        is_current_canonical = np.zeros(len(union_names), dtype = bool)
+        is_current_canonical[:len(is_canonical)] = is_canonical
+        is_previous_canonical = np.zeros(len(union_names), dtype = bool)
+        is_previous_canonical[union_ids] = previous_is_canonical
+        is_both = is_current & is_previous
+        return changes_frame([
+            ("+name", namespace_name, "", union_names[is_current & ~is_previous], None),
+            ("-name", namespace_name, "", union_names[is_previous & ~is_current], None),
+            ("+canonical", namespace_name, "", union_names[is_both & is_current_canonical & ~is_previous_canonical], None),
+            ("-canonical", namespace_name, "", union_names[is_both & ~is_current_canonical & is_previous_canonical], None),
+        ])
+
+    def links_changes(self, from_namespace_name, to_namespace_name, from_gene_ranks, to_gene_ranks):
+        from_union_names, from_union_ids, _ = self.namespaces[from_namespace_name]
+        to_union_names, to_union_ids, _ = self.namespaces[to_namespace_name]
+        keys = from_gene_ranks.astype(np.int64) * len(to_union_names) + to_gene_ranks
+        if from_namespace_name in self.index.namespace_names and to_namespace_name in self.index.namespace_names:
+            offsets, targets = self.index.links(from_namespace_name, to_namespace_name)
+            previous_keys = np.repeat(from_union_ids, np.diff(offsets)) * len(to_union_names) + to_union_ids[targets]
+        else:
+            previous_keys = np.empty(0, dtype = np.int64)
+        previous_keys = np.sort(previous_keys)
+        added_keys = keys[~is_in_sorted(previous_keys, keys)]
+        removed_keys = previous_keys[~is_in_sorted(keys, previous_keys)]
+        return changes_frame([
+            (
+                change,
+                from_namespace_name,
+                to_namespace_name,
+                from_union_names[changed_keys // len(to_union_names)],
+                to_union_names[changed_keys % len(to_union_names)],
+            )
+            for change, changed_keys in (("+link", added_keys), ("-link", removed_keys))
+        ])
+
+    def removed_namespaces_changes(self):
+        return [
+            changes_frame([("-name", namespace_name, "", self.index.gene_names(namespace_name), None)])
+            for namespace_name in self.index.namespace_names
+            if namespace_name not in self.namespaces
+        ]
+
+    def keep_file(self, file_name, names_dir):
+        previous_path = f"{self.names_dir}/{file_name}"
+        if not os.path.isfile(previous_path) or os.stat(previous_path).st_mtime > os.stat(self.index_path).st_mtime:
+            return False
+        os.link(previous_path, f"{names_dir}/{file_name}")
+        return True
+
+def ensure_shard_canonical(shard):
+    namespaces, gene_ranks, shards_count = CANONICAL_NAMESPACES
+    return namespaces.shard_canonical(gene_ranks, shard, shards_count)
+
+def write_namespace_files(namespace_name, names_dir):
+    namespaces, encoded_names, gene_ranks, namespaces_gene_ids, previous_names, only_changed = WRITTEN_NAMESPACES
+    namespace = namespaces.namespaces[namespace_name]
+    return namespaces.write_namespace_files(
+        namespace, encoded_names, gene_ranks, namespaces_gene_ids[namespace.index], names_dir, previous_names, only_changed
+    )
+
+def changes_frame(changes):
+    frames = []
+    for change, from_namespace_name, to_namespace_name, from_gene_names, to_gene_names in changes:
+        frame = pd.DataFrame({
+            "change": change,
+            "from_namespace": from_namespace_name,
+            "to_namespace": to_namespace_name,
+            "from": from_gene_names,
+            "to": "" if to_gene_names is None else to_gene_names,
+        }, columns = CHANGES_COLUMNS)
+        frames.append(frame.sort_values(["from", "to"], kind = "stable"))
+    return pd.concat(frames, ignore_index = True)
+
+def is_in_sorted(sorted_values, values):
+    positions = np.searchsorted(sorted_values, values)
+    is_found = positions < len(sorted_values)
+    is_found[is_found] = sorted_values[positions[is_found]] == values[is_found]
+    return is_found
+
+def encode_names(gene_names):
+    encoded_names = [f"{gene_name}\n".encode() for gene_name in gene_names]
+    name_lengths = np.fromiter((len(encoded_name) for encoded_name in encoded_names), dtype = np.int64, count = len(encoded_names))
+    name_starts = len(LITERALS) + np.cumsum(name_lengths) - name_lengths
+    buffer = np.frombuffer(LITERALS + b"".join(encoded_names), dtype = np.uint8)
+    return buffer, name_starts, name_lengths
+
+def write_rows(path, header, buffer, columns_starts, columns_lengths):
+    starts = np.stack(columns_starts, axis = 1)
+    lengths = np.stack(columns_lengths, axis = 1)
+    with open(path, "wb") as file:
+        file.write(header.encode())
+        for start in range(0, len(starts), WRITE_BLOCK_SIZE):
+            block_starts = starts[start:start + WRITE_BLOCK_SIZE].ravel()
+            block_lengths = lengths[start:start + WRITE_BLOCK_SIZE].ravel()
+            offsets = np.repeat(block_starts - np.cumsum(block_lengths) + block_lengths, block_lengths) \
+                + np.arange(block_lengths.sum())
+            file.write(buffer[offsets].tobytes())
+
+def label_components(genes_count, link_sources, link_targets):
+    labels = np.arange(genes_count)
+    while len(link_sources) > 0:
+        source_labels = labels[link_sources]
+        target_labels = labels[link_targets]
+        is_split = source_labels != target_labels
+        if not is_split.any():
+            break
+        link_sources = link_sources[is_split]
+        link_targets = link_targets[is_split]
+        np.minimum.at(
+            labels,
+            np.maximum(source_labels[is_split], target_labels[is_split]),
+            np.minimum(source_labels[is_split], target_labels[is_split]),
+        )
+        while True:
+            parent_labels = labels[labels]
+            if np.array_equal(parent_labels, labels):
+                break
+            labels = parent_labels
+    return labels
+
+def source_cache_key(data_path, sources_spec, normalizer):
+    digest = hashlib.sha256()
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    for script_path in (__file__, *(f"{scripts_dir}/{helper_script}" for helper_script in HELPER_SCRIPTS)):
+        with open(script_path, "rb") as file:
+            digest.update(file.read())
+    digest.update(json.dumps(sources_spec, sort_keys = True, default = str).encode())
+    digest.update(json.dumps(normalizer.namespaces_rules, sort_keys = True, default = str).encode())
+    with open(data_path, "rb") as file:
+        while block := file.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_contribution(cache_path, cache_key):
+    if not os.path.isfile(cache_path):
+        return None
+    with np.load(cache_path) as data:
+        if str(data["cache_key"]) != cache_key:
+            return None
+        return { name: data[name] for name in data.files if name != "cache_key" }
+
+def save_contribution(cache_path, cache_key, contribution):
+    os.makedirs(os.path.dirname(cache_path), exist_ok = True)
+    with open(f"{cache_path}.tmp", "wb") as file:
+        np.savez(file, cache_key = np.array(cache_key), **contribution)
+    os.replace(f"{cache_path}.tmp", cache_path)
+
+def read_frames(data_path, *, has_header, chunk_size = None, comment = None):
+    frames = pd.read_csv(
+        data_path,
+        dtype = str,
+        keep_default_na = False,
+        header="infer" if has_header else None,
+        sep = "," if data_path.removesuffix(".gz").endswith(".csv") else "\t",
+        comment = comment,
+        chunksize = chunk_size,
+    )
+    if chunk_size is None:
+        yield frames
+    else:
+        with frames:
+            yield from frames
+
+def compute_namespaces(
+    species, *, incremental = False, only_changed = False, jobs = 1, max_component_size = MAX_COMPONENT_SIZE, profiler = None
+):
+    profiler = profiler or Profiler()
     sources_dir = f"genes/{species}/namespaces/sources"
-    sources_yaml = f"genes/{species}/namespaces/sources/sources.yaml"
-    with open(sources_yaml) as file:
-        sources_spec = yaml.safe_load(file)
+    sources_spec, normalizer = read_sources(f"genes/{species}/namespaces/sources/sources.yaml")
 
-    namespaces = Namespaces(sources_dir)
+    cache_dir = f"genes/{species}/namespaces/cache" if incremental else None
+    namespaces = Namespaces(sources_dir, normalizer)
     for source_spec in sources_spec:
-        namespaces.collect_source(source_spec)
-    namespaces.collect_extra()
-    namespaces.complete_links()
-    namespaces.ensure_canonical()
+        with profiler.stage(f"collect sources/{source_spec["data_file"]}") as counts:
+            before_counts = namespaces.counts()
+            namespaces.collect_source(source_spec, cache_dir = cache_dir)
+            for name, count in namespaces.counts().items():
+                counts[name] = count - before_counts[name]
+    with profiler.stage("collect extra") as counts:
+        before_counts = namespaces.counts()
+        namespaces.collect_extra()
+        for name, count in namespaces.counts().items():
+            counts[name] = count - before_counts[name]
+    with profiler.stage("complete links") as counts:
+        namespaces.complete_links(max_component_size = max_component_size)
+        counts["links"] = len(namespaces.link_sources)
+        counts["components"] = int(np.count_nonzero(namespaces.component_sizes))
+        counts["largest_component"] = int(namespaces.component_sizes.max(initial = 0))
+        counts["oversized_components"] = int(np.count_nonzero(namespaces.is_oversized))
+    with profiler.stage("ensure canonical") as counts:
+        namespaces.ensure_canonical(jobs = jobs)
+        counts["names"] = len(namespaces.gene_names)
+        counts["canonical"] = int(np.count_nonzero(namespaces.is_canonical))
 
     names_dir = f"genes/{species}/namespaces/names"
-    namespaces.write(names_dir)
+    index_path = f"genes/{species}/namespaces/index.bin"
+    changes_path = f"genes/{species}/namespaces/changes.tsv"
+    with profiler.stage("write") as counts:
+        counts["links"] = namespaces.write(
+            names_dir, index_path, jobs = jobs, changes_path = changes_path, only_changed = only_changed
+        )
+        counts["files"] = len(namespaces.namespaces) * (len(namespaces.namespaces) + 1)
+        counts["written"] = namespaces.written_files_count
+        if namespaces.changes_count is not None:
+            counts["changes"] = namespaces.changes_count
+
+def main():
+    parser = argparse.ArgumentParser(description = "Compute the names of the namespaces of a species.")
+    parser.add_argument("--incremental", action = "store_true", help = "reuse the cached parsing of unchanged sources")
+    parser.add_argument("--only-changed", action = "store_true", help = "only rewrite the names files that differ from the previous build")
+    parser.add_argument("--jobs", type = int, default = os.cpu_count(), help = "maximal number of processes canonicalizing and writing the names")
+    parser.add_argument(
+        "--max-component-size",
+        type = int,
+        default = MAX_COMPONENT_SIZE,
+        help = "only map the names of larger components through their direct links (0: no limit)",
+    )
+    add_profile_arguments(parser)
+    parser.add_argument("species")
+    args = parser.parse_args()
+    profiler = args_profiler(args, f"genes/{args.species}/namespaces")
+    compute_namespaces(
+        args.species,
+        incremental = args.incremental,
+        only_changed = args.only_changed,
+        jobs = args.jobs,
+        max_component_size = args.max_component_size or None,
+        profiler = profiler,
+    )
+    profiler.write()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,176 @@
+import contextlib
+import os
+import re
+import sqlite3
+
+CURATION_FILE = re.compile(r"^[^.]+(\.Missing\.txt|\.Ignored\.txt|(\.[^.]+)?\.Extra\.tsv)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    file TEXT NOT NULL,
+    name TEXT NOT NULL,
+    other_name TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (file, name, other_name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS files (
+    file TEXT NOT NULL PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+class CurationStore:
+    def __init__(self, namespaces_dir):
+        self.sources_dir = f"{namespaces_dir}/sources"
+        cache_dir = f"{namespaces_dir}/cache"
+        os.makedirs(cache_dir, exist_ok = True)
+        self.connection = sqlite3.connect(f"{cache_dir}/curation.sqlite", timeout = 600, isolation_level = None)
+        self.connection.executescript(SCHEMA)
+        self.depth = 0
+        self.changed_files = set()
+
+    def close(self):
+        self.connection.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        if self.depth == 0:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.import_files()
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        self.depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.depth -= 1
+            if self.depth == 0:
+                self.changed_files.clear()
+                self.connection.execute("ROLLBACK")
+            raise
+        self.depth -= 1
+        if self.depth == 0:
+            try:
+                self.export_files()
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            finally:
+                self.changed_files.clear()
+            self.connection.execute("COMMIT")
+
+    def missing_namespace_names(self):
+        with self.transaction():
+            return sorted(
+                file[:-12]
+                for file, in self.connection.execute("SELECT DISTINCT file FROM entries WHERE file LIKE '%.Missing.txt'")
+            )
+
+    def missing_names(self, namespace_name):
+        return self.names(f"{namespace_name}.Missing.txt")
+
+    def ignored_names(self, namespace_name):
+        return set(self.names(f"{namespace_name}.Ignored.txt"))
+
+    def add_missing(self, namespace_name, gene_names):
+        self.add(f"{namespace_name}.Missing.txt", ((gene_name, "") for gene_name in gene_names))
+
+    def remove_missing(self, namespace_name, gene_names = None):
+        self.remove(f"{namespace_name}.Missing.txt", gene_names)
+
+    def add_ignored(self, namespace_name, gene_names):
+        self.add(f"{namespace_name}.Ignored.txt", ((gene_name, "") for gene_name in gene_names))
+
+    def add_extras(self, extra_file, gene_names_pairs):
+        assert CURATION_FILE.match(extra_file) and extra_file.endswith(".Extra.tsv"), f"not an extra file: {extra_file}"
+        self.add(extra_file, gene_names_pairs)
+
+    def names(self, file):
+        with self.transaction():
+            return [
+                name
+                for name, in self.connection.execute("SELECT name FROM entries WHERE file = ? ORDER BY name", (file,))
+            ]
+
+    def add(self, file, gene_names_pairs):
+        with self.transaction():
+            cursor = self.connection.executemany(
+                "INSERT OR IGNORE INTO entries (file, name, other_name) VALUES (?, ?, ?)",
+                ((file, name, other_name) for name, other_name in gene_names_pairs),
+            )
+            if cursor.rowcount != 0:
+                self.changed_files.add(file)
+
+    def remove(self, file, gene_names = None):
+        with self.transaction():
+            if gene_names is None:
+                cursor = self.connection.execute("DELETE FROM entries WHERE file = ?", (file,))
+            else:
+                cursor = self.connection.executemany(
+                    "DELETE FROM entries WHERE file = ? AND name = ?",
+                    ((file, gene_name) for gene_name in gene_names),
+                )
+            if cursor.rowcount != 0:
+                self.changed_files.add(file)
+
+    def import_files(self):
+        files_stats = {
+            file: (size, mtime_ns)
+            for file, size, mtime_ns in self.connection.execute("SELECT file, size, mtime_ns FROM files")
+        }
+        files = set(files_stats)
+        if os.path.isdir(self.sources_dir):
+            files.update(file for file in os.listdir(self.sources_dir) if CURATION_FILE.match(file))
+
+        for file in sorted(files):
+            path = f"{self.sources_dir}/{file}"
+            if not os.path.isfile(path):
+                self.connection.execute("DELETE FROM entries WHERE file = ?", (file,))
+                self.connection.execute("DELETE FROM files WHERE file = ?", (file,))
+                continue
+
+            stat = os.stat(path)
+            if files_stats.get(file) == (stat.st_size, stat.st_mtime_ns):
+                continue
+
+            print(f"Import sources/{file} ...", flush = True)
+            with open(path) as text:
+                rows = [tuple((line.split("\t", 1) + [""])[:2]) for line in text.read().split("\n") if line != ""]
+            self.connection.execute("DELETE FROM entries WHERE file = ?", (file,))
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO entries (file, name, other_name) VALUES (?, ?, ?)",
+                ((file, name, other_name) for name, other_name in rows),
+            )
+            self.record_file(file, stat)
+            if rows != sorted(set(rows)):
+                self.changed_files.add(file)
+
+    def export_files(self):
+        for file in sorted(self.changed_files):
+            path = f"{self.sources_dir}/{file}"
+            rows = self.connection.execute(
+                "SELECT name, other_name FROM entries WHERE file = ? ORDER BY name, other_name", (file,)
+            ).fetchall()
+            if len(rows) == 0:
+                if os.path.exists(path):
+                    os.remove(path)
+                self.connection.execute("DELETE FROM files WHERE file = ?", (file,))
+                continue
+
+            print(f"Export sources/{file} ...", flush = True)
+            if file.endswith(".tsv"):
+                content = "".join(f"{name}\t{other_name}\n" for name, other_name in rows)
+            else:
+                content = "".join(f"{name}\n" for name, _other_name in rows)
+            with open(f"{path}.tmp", "w") as text:
+                text.write(content)
+            os.replace(f"{path}.tmp", path)
+            self.record_file(file, os.stat(path))
+
+    def record_file(self, file, stat):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files (file, size, mtime_ns) VALUES (?, ?, ?)",
+            (file, stat.st_size, stat.st_mtime_ns),
+        )
@@ -0,0 +1,403 @@
+import http.client
+import numpy as np
+import os.path
+import pandas as pd
+import socket
+import threading
+
+from collections import OrderedDict
+from functools import cached_property
+from names_index import NamesIndex, find_sorted
+from urllib.parse import quote, urlencode, urlsplit
+
+MEMBERSHIP_FILE = "membership.npz"
+
+GENES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "genes")
+
+class Namespace:
+    def __init__(self, namespaces_dir, name, index = None, *, verbose = True):
+        self.name = name
+        if index is not None:
+            if verbose:
+                print(f"Load {name} names from index ...", flush = True)
+            self.sorted_gene_names = index.gene_names(name)
+            self.is_sorted_canonical = index.is_canonical(name)
+        else:
+            names_path = f"{namespaces_dir}/names/{name}.tsv"
+            if verbose:
+                print(f"Load {name} names ...", flush = True)
+            frame = pd.read_csv(names_path, dtype = str, keep_default_na = False, header = "infer", sep = "\t")
+            frame = frame.sort_values("name", kind = "stable")
+            self.sorted_gene_names = np.asarray(frame.loc[:, "name"], dtype = object)
+            self.is_sorted_canonical = np.asarray(frame.loc[:, "is_canonical"] == "True")
+        self.nbytes = names_nbytes(self.sorted_gene_names) + self.is_sorted_canonical.nbytes
+
+    @cached_property
+    def gene_names(self):
+        return set(self.sorted_gene_names)
+
+    @cached_property
+    def gene_index(self):
+        return pd.Index(self.sorted_gene_names)
+
+    def gene_ids(self, gene_names):
+        return self.gene_index.get_indexer(np.asarray(gene_names, dtype = object))
+
+    def is_canonical(self, gene_names):
+        gene_ids = find_sorted(self.sorted_gene_names, gene_names)
+        is_canonical = np.zeros(len(gene_ids), dtype = bool)
+        is_found = gene_ids >= 0
+        is_canonical[is_found] = self.is_sorted_canonical[gene_ids[is_found]]
+        return is_canonical
+
+class NamespaceLinks:
+    def __init__(self, namespaces_dir, first_namespace, second_namespace, index = None, *, verbose = True):
+        self.first_namespace = first_namespace
+        self.second_namespace = second_namespace
+        if verbose:
+            from_index = " from index" if index is not None else ""
+            print(f"Load mapping between {first_namespace.name} and {second_namespace.name}{from_index} ...", flush = True)
+
+        first_ids, second_ids = load_links(namespaces_dir, first_namespace, second_namespace, index)
+        second_count = len(second_namespace.sorted_gene_names)
+        forward_keys = first_ids * second_count + second_ids
+        if first_namespace.name == second_namespace.name:
+            reverse_keys = np.empty(0, dtype = np.int64)
+        else:
+            reverse_second_ids, reverse_first_ids = load_links(namespaces_dir, second_namespace, first_namespace, index)
+            reverse_keys = reverse_first_ids * second_count + reverse_second_ids
+
+        all_keys = np.concatenate([forward_keys, reverse_keys])
+        order = np.argsort(all_keys, kind = "stable")
+        all_keys = all_keys[order]
+        starts = np.flatnonzero(np.diff(all_keys, prepend = -1) != 0)
+        keys = all_keys[starts]
+        if len(keys) == 0:
+            self.is_forward = self.is_reverse = np.zeros(0, dtype = bool)
+        elif first_namespace.name == second_namespace.name:
+            self.is_forward = self.is_reverse = np.ones(len(keys), dtype = bool)
+        else:
+            self.is_forward = np.logical_or.reduceat(order < len(forward_keys), starts)
+            self.is_reverse = np.logical_or.reduceat(order >= len(forward_keys), starts)
+
+        self.first_ids = (keys // second_count).astype(np.int32)
+        self.second_ids = (keys % second_count).astype(np.int32)
+        self.first_offsets = np.searchsorted(self.first_ids, np.arange(len(first_namespace.sorted_gene_names) + 1))
+        self.reverse_order = np.lexsort((self.first_ids, self.second_ids)).astype(np.int32)
+        self.second_offsets = np.searchsorted(self.second_ids[self.reverse_order], np.arange(second_count + 1))
+        self.nbytes = sum(
+            array.nbytes
+            for array in (
+                self.first_ids, self.second_ids, self.is_forward, self.is_reverse,
+                self.first_offsets, self.reverse_order, self.second_offsets,
+            )
+        )
+
+        self.forward = NamespaceMap(first_namespace, second_namespace, self.first_offsets, None, self.second_ids, self.is_forward)
+        if first_namespace.name == second_namespace.name:
+            self.reverse = self.forward
+        else:
+            self.reverse = NamespaceMap(
+                second_namespace, first_namespace, self.second_offsets, self.reverse_order, self.first_ids, self.is_reverse
+            )
+
+    def namespace_map(self, from_namespace_name, to_namespace_name):
+        if from_namespace_name == self.first_namespace.name and to_namespace_name == self.second_namespace.name:
+            return self.forward
+        assert from_namespace_name == self.second_namespace.name and to_namespace_name == self.first_namespace.name, \
+            f"no mapping from {from_namespace_name} to {to_namespace_name} " \
+            f"between {self.first_namespace.name} and {self.second_namespace.name}"
+        return self.reverse
+
+class NamespaceMap:
+    def __init__(self, from_namespace, to_namespace, offsets, order, to_ids, is_linked):
+        self.from_namespace = from_namespace
+        self.to_namespace = to_namespace
+        self.offsets = offsets
+        self.order = order
+        self.to_ids = to_ids
+        self.is_linked = is_linked
+
+    def links_count(self):
+        return int(np.count_nonzero(self.is_linked))
+
+    @cached_property
+    def map(self):
+        map = {}
+        positions, to_gene_names = self.translate(self.from_namespace.sorted_gene_names)
+        for from_gene_name, to_gene_name in zip(self.from_namespace.sorted_gene_names[positions], to_gene_names):
+            if from_gene_name not in map:
+                map[from_gene_name] = set()
+            map[from_gene_name].add(to_gene_name)
+        return map
+
+    def translate(self, gene_names):
+        positions, to_gene_ids = self.translate_ids(find_sorted(self.from_namespace.sorted_gene_names, gene_names))
+        return positions, self.to_namespace.sorted_gene_names[to_gene_ids]
+
+    def translate_ids(self, from_gene_ids):
+        from_gene_ids = np.asarray(from_gene_ids, dtype = np.int64)
+        is_found = from_gene_ids >= 0
+        starts = np.zeros(len(from_gene_ids), dtype = np.int64)
+        stops = np.zeros(len(from_gene_ids), dtype = np.int64)
+        starts[is_found] = self.offsets[from_gene_ids[is_found]]
+        stops[is_found] = self.offsets[from_gene_ids[is_found] + 1]
+        counts = stops - starts
+        positions = np.repeat(np.arange(len(from_gene_ids)), counts)
+        links = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        if self.order is not None:
+            links = self.order[links]
+        is_linked = self.is_linked[links]
+        return positions[is_linked], self.to_ids[links[is_linked]].astype(np.int64)
+
+class ListsMembership:
+    def __init__(self, lists_dir, list_names, namespace_name):
+        membership_path = f"{lists_dir}/{MEMBERSHIP_FILE}"
+        if is_membership_current(membership_path, lists_dir, list_names):
+            with np.load(membership_path) as membership:
+                if f"{namespace_name}.names" in membership:
+                    all_list_names = np.asarray(decode_names(membership["list_names"]), dtype = object)
+                    self.gene_names = np.asarray(decode_names(membership[f"{namespace_name}.names"]), dtype = object)
+                    self.offsets = membership[f"{namespace_name}.offsets"].astype(np.int64)
+                    self.list_names = all_list_names[membership[f"{namespace_name}.lists"]]
+                    self.nbytes = names_nbytes(self.gene_names) + self.offsets.nbytes + self.list_names.nbytes
+                    return
+
+        frames = []
+        for list_name in list_names:
+            names_path = f"{lists_dir}/{list_name}/names/{namespace_name}.tsv"
+            frame = pd.read_csv(names_path, dtype = str, keep_default_na = False, header = "infer", sep = "\t")
+            frames.append(pd.DataFrame(dict(name = frame.loc[:, "name"], list = list_name)))
+        frame = pd.concat([pd.DataFrame(dict(name = [], list = []), dtype = object), *frames])
+        frame = frame.sort_values(["name", "list"], kind = "stable")
+        self.gene_names, gene_starts = np.unique(np.asarray(frame.loc[:, "name"], dtype = object), return_index = True)
+        self.offsets = np.append(gene_starts, len(frame)).astype(np.int64)
+        self.list_names = np.asarray(frame.loc[:, "list"], dtype = object)
+        self.nbytes = names_nbytes(self.gene_names) + self.offsets.nbytes + self.list_names.nbytes
+
+    def lists(self, gene_names):
+        gene_ids = find_sorted(self.gene_names, gene_names)
+        is_found = gene_ids >= 0
+        starts = np.zeros(len(gene_ids), dtype = np.int64)
+        stops = np.zeros(len(gene_ids), dtype = np.int64)
+        starts[is_found] = self.offsets[gene_ids[is_found]]
+        stops[is_found] = self.offsets[gene_ids[is_found] + 1]
+        counts = stops - starts
+        positions = np.repeat(np.arange(len(gene_ids)), counts)
+        memberships = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return positions, self.list_names[memberships]
+
+class LoadedCache:
+    def __init__(self, budget):
+        self.budget = budget
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, load):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+        entry = load()
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.entries[key] = entry
+            self.nbytes += entry.nbytes
+            self.evict()
+        return entry
+
+    def evict(self):
+        while self.nbytes > self.budget and len(self.entries) > 1:
+            _key, entry = self.entries.popitem(last = False)
+            self.nbytes -= entry.nbytes
+
+    def set_budget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+CACHE = LoadedCache(int(os.environ.get("GMARA_CACHE_BYTES", 2 << 30)))
+
+INDICES = {}
+INDICES_LOCK = threading.Lock()
+
+class Translator:
+    def __init__(self, species, *, genes_dir = GENES_DIR):
+        self.species = species
+        self.namespaces_dir = f"{genes_dir}/{species}/namespaces"
+        index_path = f"{self.namespaces_dir}/index.bin"
+        if os.path.isfile(index_path):
+            self.version = os.stat(index_path).st_mtime_ns
+            with INDICES_LOCK:
+                index = INDICES.get(index_path)
+                if index is None or index[0] != self.version:
+                    index = INDICES[index_path] = (self.version, NamesIndex(index_path))
+            self.index = index[1]
+        else:
+            self.version = os.stat(f"{self.namespaces_dir}/names").st_mtime_ns
+            self.index = None
+        self.lists_dir = f"{genes_dir}/{species}/lists"
+
+    def namespace_names(self):
+        if self.index is not None:
+            return list(self.index.namespace_names)
+        return sorted(
+            names_file[:-4]
+            for names_file in os.listdir(f"{self.namespaces_dir}/names")
+            if names_file.endswith(".tsv") and names_file.count(".") == 1
+        )
+
+    def list_names(self):
+        if not os.path.isdir(self.lists_dir):
+            return []
+        return sorted(
+            list_name
+            for list_name in os.listdir(self.lists_dir)
+            if os.path.isdir(f"{self.lists_dir}/{list_name}/names")
+        )
+
+    def namespace(self, namespace_name):
+        return CACHE.get(
+            ("namespace", self.namespaces_dir, self.version, namespace_name),
+            lambda: Namespace(self.namespaces_dir, namespace_name, self.index, verbose = False),
+        )
+
+    def namespace_links(self, first_namespace_name, second_namespace_name):
+        first_namespace_name, second_namespace_name = sorted((first_namespace_name, second_namespace_name))
+        return CACHE.get(
+            ("links", self.namespaces_dir, self.version, first_namespace_name, second_namespace_name),
+            lambda: NamespaceLinks(
+                self.namespaces_dir,
+                self.namespace(first_namespace_name),
+                self.namespace(second_namespace_name),
+                self.index,
+                verbose = False,
+            ),
+        )
+
+    def namespace_map(self, from_namespace_name, to_namespace_name):
+        return self.namespace_links(from_namespace_name, to_namespace_name).namespace_map(from_namespace_name, to_namespace_name)
+
+    def translate(self, gene_names, from_namespace_name, to_namespace_name):
+        return self.namespace_map(from_namespace_name, to_namespace_name).translate(gene_names)
+
+    def is_canonical(self, gene_names, namespace_name):
+        return self.namespace(namespace_name).is_canonical(gene_names)
+
+    def canonicalize(self, gene_names, namespace_name):
+        gene_names = np.asarray(gene_names, dtype = object)
+        canonical_positions = np.flatnonzero(self.is_canonical(gene_names, namespace_name))
+        positions, canonical_names = self.translate(gene_names, namespace_name, namespace_name)
+        is_alternative = ~np.isin(positions, canonical_positions)
+        positions = np.concatenate([canonical_positions, positions[is_alternative]])
+        canonical_names = np.concatenate([gene_names[canonical_positions], canonical_names[is_alternative]])
+        order = np.argsort(positions, kind = "stable")
+        return positions[order], canonical_names[order]
+
+    def lists(self, gene_names, namespace_name):
+        list_names = self.list_names()
+        version = tuple(os.stat(f"{self.lists_dir}/{list_name}/names").st_mtime_ns for list_name in list_names)
+        membership_path = f"{self.lists_dir}/{MEMBERSHIP_FILE}"
+        if os.path.isfile(membership_path):
+            version += (os.stat(membership_path).st_mtime_ns,)
+        return CACHE.get(
+            ("lists", self.lists_dir, tuple(list_names), version, namespace_name),
+            lambda: ListsMembership(self.lists_dir, list_names, namespace_name),
+        ).lists(gene_names)
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, *, timeout = 60):
+        super().__init__("localhost", timeout = timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class Client:
+    def __init__(self, url = None, *, timeout = 60):
+        url = url or os.environ.get("GMARA_URL", "http://localhost:8765")
+        if url.startswith("unix:"):
+            self.connection = UnixHTTPConnection(url[5:], timeout = timeout)
+        else:
+            url = urlsplit(url)
+            self.connection = http.client.HTTPConnection(url.hostname, url.port, timeout = timeout)
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.connection.close()
+
+    def query(self, species, operation, gene_names, **parameters):
+        body = "".join(f"{gene_name}\n" for gene_name in gene_names).encode()
+        path = f"/{quote(species)}/{operation}?{urlencode(parameters)}"
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    self.connection.request("POST", path, body, { "Content-Type": "text/plain; charset=utf-8" })
+                    response = self.connection.getresponse()
+                    content = response.read()
+                    break
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    self.connection.close()
+                    if attempt > 0:
+                        raise
+        if response.status != 200:
+            raise RuntimeError(f"failed to {operation} in: {species} error: {content.decode().strip()}")
+        rows = [row.split("\t") for row in content.decode().split("\n")[:-1]]
+        positions = np.fromiter((int(row[0]) for row in rows), dtype = np.int64, count = len(rows))
+        values = np.empty(len(rows), dtype = object)
+        values[:] = [row[-1] for row in rows]
+        return positions, values
+
+    def translate(self, species, gene_names, from_namespace_name, to_namespace_name):
+        return self.query(species, "translate", gene_names, **{ "from": from_namespace_name, "to": to_namespace_name })
+
+    def is_canonical(self, species, gene_names, namespace_name):
+        positions, _values = self.query(species, "is_canonical", gene_names, namespace = namespace_name)
+        is_canonical = np.zeros(len(gene_names), dtype = bool)
+        is_canonical[positions] = True
+        return is_canonical
+
+    def canonicalize(self, species, gene_names, namespace_name):
+        return self.query(species, "canonicalize", gene_names, namespace = namespace_name)
+
+    def lists(self, species, gene_names, namespace_name):
+        return self.query(species, "lists", gene_names, namespace = namespace_name)
+
+def load_links(namespaces_dir, from_namespace, to_namespace, index):
+    if index is not None:
+        offsets, targets = index.links(from_namespace.name, to_namespace.name)
+        from_gene_ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        return from_gene_ids, np.asarray(targets, dtype = np.int64)
+
+    names_path = f"{namespaces_dir}/names/{from_namespace.name}.{to_namespace.name}.tsv"
+    frame = pd.read_csv(names_path, dtype = str, keep_default_na = False, header = "infer", sep = "\t")
+    from_gene_ids = from_namespace.gene_ids(frame.loc[:, "from"].values)
+    to_gene_ids = to_namespace.gene_ids(frame.loc[:, "to"].values)
+    is_found = (from_gene_ids >= 0) & (to_gene_ids >= 0)
+    return from_gene_ids[is_found], to_gene_ids[is_found]
+
+def is_membership_current(membership_path, lists_dir, list_names):
+    if not os.path.isfile(membership_path):
+        return False
+    membership_mtime = os.stat(membership_path).st_mtime_ns
+    if any(os.stat(f"{lists_dir}/{list_name}/names").st_mtime_ns > membership_mtime for list_name in list_names):
+        return False
+    with np.load(membership_path) as membership:
+        return decode_names(membership["list_names"]) == list(list_names)
+
+def decode_names(encoded_names):
+    return encoded_names.tobytes().decode().split("\n")[:-1]
+
+def names_nbytes(gene_names):
+    return gene_names.nbytes + sum(len(gene_name) for gene_name in gene_names) + 49 * len(gene_names)
@@ -0,0 +1,107 @@
+import json
+import numpy as np
+import os
+import weakref
+
+MAGIC = b"GMARAIDX"
+VERSION = 1
+ALIGNMENT = 64
+
+class NamesIndex:
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.data = np.memmap(index_path, dtype = np.uint8, mode = "r")
+        assert bytes(self.data[:8]) == MAGIC, f"not a names index: {index_path}"
+        header_size = int(self.data[8:16].view(np.uint64)[0])
+        header = json.loads(bytes(self.data[16:16 + header_size]))
+        assert header["version"] == VERSION, f"unsupported names index version: {header["version"]} in: {index_path}"
+        self.data_offset = aligned(16 + header_size)
+        self.namespace_names = header["namespaces"]
+        self.sections = header["sections"]
+        self.namespaces_gene_names = weakref.WeakValueDictionary()
+
+    def section(self, name):
+        dtype, offset, size = self.sections[name]
+        dtype = np.dtype(dtype)
+        offset += self.data_offset
+        return self.data[offset:offset + size * dtype.itemsize].view(dtype)
+
+    def genes_count(self, namespace_name):
+        return len(self.section(f"{namespace_name}/name_offsets")) - 1
+
+    def gene_names(self, namespace_name):
+        gene_names = self.namespaces_gene_names.get(namespace_name)
+        if gene_names is None:
+            gene_names = np.empty(self.genes_count(namespace_name), dtype = object)
+            gene_names[:] = self.section(f"{namespace_name}/names").tobytes().decode().split("\n")[:-1]
+            self.namespaces_gene_names[namespace_name] = gene_names
+        return gene_names
+
+    def gene_ids(self, namespace_name, gene_names):
+        return find_sorted(self.gene_names(namespace_name), gene_names)
+
+    def is_canonical(self, namespace_name):
+        is_canonical = np.unpackbits(self.section(f"{namespace_name}/is_canonical"))
+        return is_canonical[:self.genes_count(namespace_name)].astype(bool)
+
+    def links(self, from_namespace_name, to_namespace_name):
+        return (
+            self.section(f"{from_namespace_name}/{to_namespace_name}/offsets"),
+            self.section(f"{from_namespace_name}/{to_namespace_name}/targets"),
+        )
+
+class NamesIndexWriter:
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.namespace_names = []
+        self.arrays = {}
+
+    def add_namespace(self, namespace_name, gene_names, is_canonical):
+        self.namespace_names.append(namespace_name)
+        encoded_names = [f"{gene_name}\n".encode() for gene_name in gene_names]
+        name_offsets = np.zeros(len(encoded_names) + 1, dtype = np.int64)
+        np.cumsum(
+            np.fromiter((len(encoded_name) for encoded_name in encoded_names), dtype = np.int64, count = len(encoded_names)),
+            out = name_offsets[1:],
+        )
+        self.arrays[f"{namespace_name}/names"] = np.frombuffer(b"".join(encoded_names), dtype = np.uint8)
+        self.arrays[f"{namespace_name}/name_offsets"] = name_offsets
+        self.arrays[f"{namespace_name}/is_canonical"] = np.packbits(is_canonical)
+
+    def add_links(self, from_namespace_name, to_namespace_name, from_genes_count, from_gene_ids, to_gene_ids):
+        offsets_dtype = np.int32 if len(to_gene_ids) < 2 ** 31 else np.int64
+        self.arrays[f"{from_namespace_name}/{to_namespace_name}/offsets"] = \
+            np.searchsorted(from_gene_ids, np.arange(from_genes_count + 1)).astype(offsets_dtype)
+        self.arrays[f"{from_namespace_name}/{to_namespace_name}/targets"] = to_gene_ids.astype(np.int32)
+
+    def write(self):
+        print(f"Write {os.path.basename(self.index_path)} ...", flush = True)
+        sections = {}
+        offset = 0
+        for name, array in self.arrays.items():
+            sections[name] = (array.dtype.str, offset, len(array))
+            offset += aligned(array.nbytes)
+        header = json.dumps(dict(version = VERSION, namespaces = self.namespace_names, sections = sections)).encode()
+        data_offset = aligned(16 + len(header))
+
+        temporary_path = f"{self.index_path}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(MAGIC)
+            file.write(np.uint64(len(header)).tobytes())
+            file.write(header)
+            file.write(b"\0" * (data_offset - 16 - len(header)))
+            for array in self.arrays.values():
+                file.write(array.tobytes())
+                file.write(b"\0" * (aligned(array.nbytes) - array.nbytes))
+        os.replace(temporary_path, self.index_path)
+
+def aligned(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def find_sorted(sorted_gene_names, gene_names):
+    gene_names = np.asarray(gene_names, dtype = object)
+    gene_ids = np.searchsorted(sorted_gene_names, gene_names)
+    is_found = gene_ids < len(sorted_gene_names)
+    is_found[is_found] = sorted_gene_names[gene_ids[is_found]] == gene_names[is_found]
+    gene_ids[~is_found] = -1
+    return gene_ids
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import re
+import yaml
+
+SEPARATORS = re.compile(r"[| ,;\t]")
+
+class Normalizer:
+    def __init__(self, namespaces_rules = None):
+        self.namespaces_rules = namespaces_rules or {}
+
+    def keep_version(self, namespace_name):
+        return self.namespaces_rules.get(namespace_name, {}).get("keep_version", False)
+
+    def normalize_name(self, namespace_name, name):
+        if self.keep_version(namespace_name):
+            return name
+        parts = name.split(".")
+        if len(parts) == 2:
+            return parts[0]
+        else:
+            return name
+
+    def normalize_names(self, namespace_name, gene_names):
+        gene_codes, unique_gene_names = pd.factorize(np.asarray(gene_names, dtype = object))
+        normalized_names = np.empty(len(unique_gene_names) + 1, dtype = object)
+        normalized_names[-1] = ""
+        normalized_names[:-1] = [self.normalize_name(namespace_name, gene_name) for gene_name in unique_gene_names]
+        return normalized_names[gene_codes]
+
+    def split_names(self, namespace_name, gene_names):
+        gene_codes, unique_cells = pd.factorize(gene_names.fillna("").values)
+        cells = pd.Series(unique_cells, dtype = object)
+        is_split = cells.str.contains(SEPARATORS, regex = True)
+        if is_split.any():
+            cells_names = pd.concat([cells[~is_split], cells[is_split].str.split(SEPARATORS, regex = True).explode()])
+            cells_names = cells_names.sort_index(kind = "stable")
+        else:
+            cells_names = cells
+        if not self.keep_version(namespace_name):
+            is_versioned = cells_names.str.contains(".", regex = False)
+            cells_names[is_versioned] = [
+                self.normalize_name(namespace_name, gene_name) for gene_name in cells_names[is_versioned].values
+            ]
+        cells_names = cells_names[cells_names != ""]
+
+        cells_counts = np.bincount(cells_names.index.values, minlength = len(unique_cells))
+        cells_starts = np.cumsum(cells_counts) - cells_counts
+        flat_names = cells_names.values.astype(object)
+
+        is_found = gene_codes >= 0
+        gene_codes = gene_codes[is_found]
+        counts = cells_counts[gene_codes]
+        offsets = np.repeat(cells_starts[gene_codes] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return pd.Series(flat_names[offsets], index = np.repeat(gene_names.index[is_found], counts), dtype = object)
+
+def read_sources(sources_yaml):
+    with open(sources_yaml) as file:
+        sources_spec = yaml.safe_load(file) or []
+    namespaces_rules = {
+        source_spec["namespace"]: source_spec
+        for source_spec in sources_spec
+        if "data_file" not in source_spec
+    }
+    return [source_spec for source_spec in sources_spec if "data_file" in source_spec], Normalizer(namespaces_rules)
@@ -0,0 +1,105 @@
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+class Profiler:
+    def __init__(self, report_path = None, *, cprofile_path = None):
+        self.report_path = report_path
+        self.cprofile_path = cprofile_path
+        self.stages = []
+        self.cprofiles = {}
+        self.started = datetime.now(timezone.utc).isoformat()
+        self.wall_time = time.perf_counter()
+        self.cpu_time = time.process_time()
+        self.process_peak_rss_bytes = 0
+
+    @contextmanager
+    def stage(self, name):
+        counts = {}
+        if self.report_path is None:
+            yield counts
+            return
+
+        profile = cProfile.Profile() if self.cprofile_path is not None else None
+        overall_peak_rss_bytes = self.process_peak_rss_bytes = self.overall_peak_rss_bytes()
+        children_peak_rss_bytes = peak_rss_bytes(resource.RUSAGE_CHILDREN)
+        reset_peak_rss()
+        wall_time = time.perf_counter()
+        cpu_time = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield counts
+        finally:
+            if profile is not None:
+                profile.disable()
+            stage_children_peak_rss_bytes = peak_rss_bytes(resource.RUSAGE_CHILDREN)
+            self.stages.append(dict(
+                name = name,
+                wall_seconds = time.perf_counter() - wall_time,
+                cpu_seconds = time.process_time() - cpu_time,
+                peak_rss_bytes = max(
+                    peak_rss_bytes(),
+                    stage_children_peak_rss_bytes if stage_children_peak_rss_bytes > children_peak_rss_bytes else 0,
+                ),
+                peak_rss_growth_bytes = self.overall_peak_rss_bytes() - overall_peak_rss_bytes,
+                counts = counts,
+            ))
+            if profile is not None:
+                self.cprofiles[len(self.stages) - 1] = profile
+
+    def write(self):
+        if self.report_path is None:
+            return
+        report = dict(
+            script = os.path.basename(sys.argv[0]),
+            arguments = sys.argv[1:],
+            started = self.started,
+            wall_seconds = time.perf_counter() - self.wall_time,
+            cpu_seconds = time.process_time() - self.cpu_time,
+            peak_rss_bytes = self.overall_peak_rss_bytes(),
+            stages = self.stages,
+        )
+        if len(self.stages) > 0:
+            hottest_stage = max(range(len(self.stages)), key = lambda stage: self.stages[stage]["wall_seconds"])
+            report["hottest_stage"] = self.stages[hottest_stage]["name"]
+            if hottest_stage in self.cprofiles:
+                self.cprofiles[hottest_stage].dump_stats(self.cprofile_path)
+                report["cprofile"] = self.cprofile_path
+
+        print(f"Write {self.report_path} ...", flush = True)
+        with open(self.report_path, "w") as file:
+            json.dump(report, file, indent = 2)
+            file.write("\n")
+
+    def overall_peak_rss_bytes(self):
+        return max(self.process_peak_rss_bytes, peak_rss_bytes(), peak_rss_bytes(resource.RUSAGE_CHILDREN))
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+def peak_rss_bytes(who = resource.RUSAGE_SELF):
+    peak_rss = resource.getrusage(who).ru_maxrss
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", action = "store_true", help = "write the time and memory used by each stage to profile.json")
+    parser.add_argument("--cprofile", action = "store_true", help = "also dump the cProfile of the slowest stage to profile.prof")
+
+def args_profiler(args, output_dir):
+    if not args.profile and not args.cprofile:
+        return Profiler()
+    return Profiler(
+        f"{output_dir}/profile.json",
+        cprofile_path = f"{output_dir}/profile.prof" if args.cprofile else None,
+    )
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import numpy as np
+import os
+import socketserver
+import threading
+import time
+
+from collections import deque
+from gmara import GENES_DIR, Translator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+LATENCIES_COUNT = 10000
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def record(self, operation, seconds, names_count, rows_count, is_ok):
+        with self.lock:
+            metrics = self.operations.get(operation)
+            if metrics is None:
+                metrics = self.operations[operation] = dict(
+                    requests = 0,
+                    errors = 0,
+                    names = 0,
+                    rows = 0,
+                    seconds = 0.0,
+                    latencies = deque(maxlen = LATENCIES_COUNT),
+                )
+            metrics["requests"] += 1
+            metrics["errors"] += 0 if is_ok else 1
+            metrics["names"] += names_count
+            metrics["rows"] += rows_count
+            metrics["seconds"] += seconds
+            metrics["latencies"].append(seconds)
+
+    def report(self):
+        with self.lock:
+            report = dict(uptime_seconds = time.time() - self.started, operations = {})
+            for operation, metrics in sorted(self.operations.items()):
+                latencies = np.array(metrics["latencies"]) * 1000
+                report["operations"][operation] = dict(
+                    requests = metrics["requests"],
+                    errors = metrics["errors"],
+                    names = metrics["names"],
+                    rows = metrics["rows"],
+                    mean_ms = metrics["seconds"] * 1000 / metrics["requests"],
+                    p50_ms = float(np.percentile(latencies, 50)),
+                    p99_ms = float(np.percentile(latencies, 99)),
+                    max_ms = float(latencies.max()),
+                )
+            return report
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/metrics":
+            self.respond(200, json.dumps(self.server.metrics.report(), indent = 2) + "\n", "application/json")
+        elif path == "/health":
+            self.respond(200, "OK\n")
+        else:
+            self.respond(404, f"unknown path: {path}\n")
+
+    def do_POST(self):
+        started = time.perf_counter()
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        operation = parts[-1] if len(parts) == 2 else "unknown"
+        content = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        status = 200
+        rows_count = 0
+        gene_names = []
+        try:
+            gene_names = content.decode().split("\n")
+            if gene_names[-1] == "":
+                gene_names.pop()
+            if len(parts) != 2 or not hasattr(self, f"query_{operation}"):
+                status = 404
+                body = f"unknown path: {url.path}\n"
+            else:
+                parameters = { name: values[-1] for name, values in parse_qs(url.query).items() }
+                translator = self.translator(unquote(parts[0]), parameters)
+                positions, values = getattr(self, f"query_{operation}")(translator, gene_names, parameters)
+                rows_count = len(positions)
+                if values is None:
+                    body = "".join(f"{position}\n" for position in positions)
+                else:
+                    body = "".join(f"{position}\t{value}\n" for position, value in zip(positions, values))
+        except (AssertionError, KeyError, UnicodeDecodeError) as exception:
+            status = 400
+            body = f"{type(exception).__name__}: {exception}\n"
+        except Exception as exception:
+            status = 500
+            body = f"{type(exception).__name__}: {exception}\n"
+
+        seconds = time.perf_counter() - started
+        self.server.metrics.record(operation, seconds, len(gene_names), rows_count, status == 200)
+        self.respond(status, body, "text/tab-separated-values", seconds = seconds)
+
+    def translator(self, species, parameters):
+        assert os.path.isdir(f"{self.server.genes_dir}/{species}/namespaces"), f"unknown species: {species}"
+        translator = Translator(species, genes_dir = self.server.genes_dir)
+        namespace_names = translator.namespace_names()
+        for parameter in ("from", "to", "namespace"):
+            if parameter in parameters:
+                assert parameters[parameter] in namespace_names, \
+                    f"unknown namespace: {parameters[parameter]} in: {species}"
+        return translator
+
+    def query_translate(self, translator, gene_names, parameters):
+        return translator.translate(gene_names, parameters["from"], parameters["to"])
+
+    def query_is_canonical(self, translator, gene_names, parameters):
+        return np.flatnonzero(translator.is_canonical(gene_names, parameters["namespace"])), None
+
+    def query_canonicalize(self, translator, gene_names, parameters):
+        return translator.canonicalize(gene_names, parameters["namespace"])
+
+    def query_lists(self, translator, gene_names, parameters):
+        return translator.lists(gene_names, parameters["namespace"])
+
+    def respond(self, status, body, content_type = "text/plain", *, seconds = None):
+        content = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        if seconds is not None:
+            self.send_header("Server-Timing", f"gmara;dur={seconds * 1000:.3f}")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            print(f"{self.address_string() or "unix"} - {format % args}", flush = True)
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else ""
+
+class TCPRequestHandler(RequestHandler):
+    disable_nagle_algorithm = True
+
+class HTTPServer(ThreadingHTTPServer):
+    def __init__(self, address, *, genes_dir, verbose):
+        super().__init__(address, TCPRequestHandler)
+        self.genes_dir = genes_dir
+        self.verbose = verbose
+        self.metrics = Metrics()
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, *, genes_dir, verbose):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, RequestHandler)
+        self.genes_dir = genes_dir
+        self.verbose = verbose
+        self.metrics = Metrics()
+
+def preload(species, genes_dir):
+    print(f"Preload genes/{species} ...", flush = True)
+    translator = Translator(species, genes_dir = genes_dir)
+    namespace_names = translator.namespace_names()
+    for from_namespace_name in namespace_names:
+        translator.namespace(from_namespace_name)
+        for to_namespace_name in namespace_names:
+            translator.namespace_map(from_namespace_name, to_namespace_name)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Serve gene name translation queries from a single resident copy of the names.")
+    parser.add_argument("--host", default = "127.0.0.1", help = "the address to listen on")
+    parser.add_argument("--port", type = int, default = 8765, help = "the port to listen on")
+    parser.add_argument("--socket", help = "listen on this Unix socket instead of a port")
+    parser.add_argument("--genes-dir", default = GENES_DIR, help = "the directory containing the species")
+    parser.add_argument("--verbose", action = "store_true", help = "log every request")
+    parser.add_argument("species", nargs = "*", help = "the species to load before serving (default: load on first use)")
+    args = parser.parse_args()
+
+    for species in args.species:
+        preload(species, args.genes_dir)
+
+    if args.socket is not None:
+        server = UnixHTTPServer(args.socket, genes_dir = args.genes_dir, verbose = args.verbose)
+        print(f"Serve on unix:{args.socket} ...", flush = True)
+    else:
+        server = HTTPServer((args.host, args.port), genes_dir = args.genes_dir, verbose = args.verbose)
+        print(f"Serve on http://{args.host}:{args.port} ...", flush = True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+if __name__ == "__main__":
+    main()
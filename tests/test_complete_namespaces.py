@@ -0,0 +1,171 @@
+import pytest
+import time
+
+from complete_namespaces import Fetcher, TokenBucket, complete_Ensembl, complete_Symbol
+from normalization import Normalizer
+from urllib.parse import parse_qs, urlsplit
+
+def test_retry_after_throttling_and_server_errors(stub_server):
+    statuses = [429, 503, 500, 200]
+
+    def respond(command, path, payload):
+        status = statuses.pop(0)
+        return status, dict(ok = status == 200), { "Retry-After": "0" } if status == 429 else {}
+
+    stub_server.respond = respond
+    fetcher = Fetcher(None, backoff = 0.01)
+    try:
+        assert fetcher.get_json(f"{stub_server.url}/gene") == dict(ok = True)
+    finally:
+        fetcher.close()
+    assert len(stub_server.requests) == 4
+    assert fetcher.counts == dict(requests = 1, retries = 3, cached = 0)
+
+def test_give_up_after_retries(stub_server):
+    stub_server.respond = lambda command, path, payload: (502, None, {})
+    fetcher = Fetcher(None, retries = 2, backoff = 0.01)
+    try:
+        with pytest.raises(RuntimeError, match = "HTTP status 502"):
+            fetcher.get_json(f"{stub_server.url}/gene")
+    finally:
+        fetcher.close()
+    assert len(stub_server.requests) == 3
+
+def test_client_errors_are_not_retried(stub_server):
+    stub_server.respond = lambda command, path, payload: (400, None, {})
+    fetcher = Fetcher(None, backoff = 0.01)
+    try:
+        with pytest.raises(Exception, match = "400"):
+            fetcher.get_json(f"{stub_server.url}/gene")
+    finally:
+        fetcher.close()
+    assert len(stub_server.requests) == 1
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(50, 5)
+    started = time.monotonic()
+    for _token in range(30):
+        bucket.acquire()
+    assert time.monotonic() - started >= (30 - 5) / 50 * 0.9
+
+def test_fetcher_rate(stub_server):
+    stub_server.respond = lambda command, path, payload: (200, path, {})
+    fetcher = Fetcher(None, jobs = 8, rate = 20)
+    started = time.monotonic()
+    try:
+        fetcher.get_jsons([f"{stub_server.url}/gene/{index}" for index in range(30)])
+    finally:
+        fetcher.close()
+    assert time.monotonic() - started >= (30 - 20) / 20 * 0.9
+
+def test_cache_hits_on_second_run(stub_server, tmp_path):
+    stub_server.respond = lambda command, path, payload: (200, dict(path = path, payload = payload), {})
+    urls = [f"{stub_server.url}/gene/{index}" for index in range(3)]
+    payloads = [dict(id = ["A", "B"]), dict(id = ["C"])]
+    results = []
+    for _run in range(2):
+        fetcher = Fetcher(str(tmp_path / "cache"))
+        try:
+            results.append((fetcher.get_jsons(urls), fetcher.post_jsons(f"{stub_server.url}/archive", payloads)))
+        finally:
+            fetcher.close()
+    assert results[0] == results[1]
+    assert results[1][1][1] == dict(path = "/archive", payload = dict(id = ["C"]))
+    assert len(stub_server.requests) == 5
+    assert fetcher.counts == dict(requests = 0, retries = 0, cached = 5)
+
+def ensembl_stub(stub_server, monkeypatch, *, failed_ids = (), tark_ids = {}):
+    monkeypatch.setattr("complete_namespaces.ENSEMBL_URL", stub_server.url)
+    monkeypatch.setattr("complete_namespaces.TARK_URL", stub_server.url)
+
+    def respond(command, path, payload):
+        if path == "/archive/id":
+            if any(ensembl_id in failed_ids for ensembl_id in payload["id"]):
+                return 503, None, {}
+            return 200, [
+                dict(id = f"{ensembl_id}.1", latest = f"{ensembl_id}.1" if ensembl_id in tark_ids else f"{ensembl_id}R.2")
+                for ensembl_id in payload["id"]
+            ], {}
+        ensembl_id = parse_qs(urlsplit(path).query)["identifier_field"][0]
+        stable_id = tark_ids.get(ensembl_id)
+        return 200, [] if stable_id is None else [dict(stable_id = "ENST1.1", genes = [dict(stable_id = f"{stable_id}.3")])], {}
+
+    stub_server.respond = respond
+
+def test_ensembl_batches(stub_server, monkeypatch):
+    ensembl_stub(stub_server, monkeypatch)
+    ensembl_ids = [f"ENSG{index:011d}" for index in range(2500)]
+    fetcher = Fetcher(None, rate = 1000)
+    try:
+        genes_extras = complete_Ensembl(fetcher, Normalizer(), ensembl_ids)
+    finally:
+        fetcher.close()
+    assert sorted(len(payload["id"]) for _command, _path, payload in stub_server.requests) == [500, 1000, 1000]
+    assert genes_extras == { ensembl_id: { "Ensembl.Extra.tsv": { f"{ensembl_id}R" } } for ensembl_id in ensembl_ids }
+
+def test_ensembl_tark_fallback(stub_server, monkeypatch):
+    ensembl_stub(stub_server, monkeypatch, failed_ids = { "ENSG4" }, tark_ids = dict(ENSG1 = None, ENSG2 = "ENSGX", ENSG4 = "ENSGY"))
+    monkeypatch.setattr("complete_namespaces.ENSEMBL_BATCH_SIZE", 3)
+    ensembl_ids = [f"ENSG{index}" for index in range(7)]
+    fetcher = Fetcher(None, rate = 1000, retries = 1, backoff = 0.01)
+    try:
+        genes_extras = complete_Ensembl(fetcher, Normalizer(), ensembl_ids)
+    finally:
+        fetcher.close()
+    archive_requests = [payload["id"] for _command, path, payload in stub_server.requests if path == "/archive/id"]
+    assert sorted(archive_requests) == [["ENSG0", "ENSG1", "ENSG2"], ["ENSG3", "ENSG4", "ENSG5"], ["ENSG3", "ENSG4", "ENSG5"], ["ENSG6"]]
+    tark_ids = sorted(parse_qs(urlsplit(path).query)["identifier_field"][0] for _command, path, _payload in stub_server.requests if path != "/archive/id")
+    assert tark_ids == ["ENSG1", "ENSG2", "ENSG3", "ENSG4", "ENSG5"]
+    assert genes_extras == dict(
+        ENSG0 = { "Ensembl.Extra.tsv": { "ENSG0R" } },
+        ENSG2 = { "Ensembl.Extra.tsv": { "ENST1", "ENSGX" } },
+        ENSG4 = { "Ensembl.Extra.tsv": { "ENST1", "ENSGY" } },
+        ENSG6 = { "Ensembl.Extra.tsv": { "ENSG6R" } },
+    )
+
+@pytest.mark.parametrize("max_region_size, regions", [
+    (1000, ["1:100:300", "2:10:20"]),
+    (150, ["1:100:200", "1:150:300", "2:10:20"]),
+])
+def test_symbol_merged_regions(stub_server, monkeypatch, max_region_size, regions):
+    monkeypatch.setattr("complete_namespaces.UCSC_URL", stub_server.url)
+    monkeypatch.setattr("complete_namespaces.ENSEMBL_URL", stub_server.url)
+    monkeypatch.setattr("complete_namespaces.MAX_REGION_SIZE", max_region_size)
+    positions = dict(A = "chr1:100-200", B = "chr1:150-300", C = "chr2:10-20", D = None)
+    chromosomes_genes = {
+        "1": [
+            dict(external_name = "GA", gene_id = "ENSG1", start = 100, end = 180),
+            dict(external_name = "GB", gene_id = "ENSG2", start = 250, end = 300),
+        ],
+        "2": [dict(external_name = "GC", canonical_transcript = "ENST3.1", start = 10, end = 20)],
+    }
+
+    def respond(command, path, payload):
+        url = urlsplit(path)
+        if url.path == "/search":
+            position = positions[parse_qs(url.query)["search"][0]]
+            return 200, dict(positionMatches = [] if position is None else [dict(matches = [dict(position = position)])]), {}
+        chromosome, start, end = url.path.split("/")[-1].split(":")
+        return 200, [
+            gene
+            for gene in chromosomes_genes[chromosome]
+            if gene["start"] <= int(end) and gene["end"] >= int(start)
+        ], {}
+
+    stub_server.respond = respond
+    fetcher = Fetcher(None, rate = 1000)
+    try:
+        genes_extras = complete_Symbol(fetcher, Normalizer(), list(positions))
+    finally:
+        fetcher.close()
+    overlap_regions = sorted(
+        urlsplit(path).path.split("/")[-1]
+        for _command, path, _payload in stub_server.requests
+        if path.startswith("/overlap/")
+    )
+    assert overlap_regions == regions
+    assert genes_extras == dict(
+        A = { "Symbol.Extra.tsv": { "GA" }, "Symbol.Ensembl.Extra.tsv": { "ENSG1" } },
+        B = { "Symbol.Extra.tsv": { "GA", "GB" }, "Symbol.Ensembl.Extra.tsv": { "ENSG1", "ENSG2" } },
+        C = { "Symbol.Extra.tsv": { "GC" }, "Symbol.Ensembl.Extra.tsv": { "ENST3" } },
+    )
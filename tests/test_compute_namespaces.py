@@ -0,0 +1,70 @@
+import pandas as pd
+
+from compute_namespaces import HELPER_SCRIPTS, compute_namespaces, source_cache_key
+from normalization import Normalizer
+
+SOURCES_YAML = """
+- data_file: E.tsv
+  columns:
+    Ensembl: { namespace: Ensembl }
+    Alias: { namespace: Symbol, is_alternative: true }
+- data_file: H.tsv
+  columns:
+    HGNC: { namespace: HGNC }
+    Symbol: { namespace: Symbol }
+    Alias: { namespace: Symbol, is_alternative: true }
+"""
+
+def write_species(tmp_path, files):
+    sources_dir = tmp_path / "genes/test/namespaces/sources"
+    sources_dir.mkdir(parents = True)
+    for name, content in files.items():
+        (sources_dir / name).write_text(content)
+
+def read_links(tmp_path, first_namespace_name, second_namespace_name):
+    path = tmp_path / f"genes/test/namespaces/names/{first_namespace_name}.{second_namespace_name}.tsv"
+    links = pd.read_csv(path, sep = "\t", dtype = str, keep_default_na = False)
+    return set(zip(links.iloc[:, 0], links.iloc[:, 1]))
+
+def test_links_through_alternative_names(tmp_path, monkeypatch):
+    write_species(tmp_path, {
+        "sources.yaml": SOURCES_YAML,
+        "E.tsv": "Ensembl\tAlias\nENSG1\tA\n",
+        "H.tsv": "HGNC\tSymbol\tAlias\nHGNC:1\tS1\tA\n",
+    })
+    monkeypatch.chdir(tmp_path)
+    compute_namespaces("test")
+    assert read_links(tmp_path, "Ensembl", "HGNC") == {("ENSG1", "HGNC:1")}
+    assert read_links(tmp_path, "Ensembl", "Symbol") == {("ENSG1", "S1")}
+    assert read_links(tmp_path, "HGNC", "Ensembl") == {("HGNC:1", "ENSG1")}
+
+def test_oversized_components(tmp_path, monkeypatch, capsys):
+    write_species(tmp_path, {
+        "sources.yaml": SOURCES_YAML,
+        "E.tsv": "Ensembl\tAlias\nENSG1\tA\nENSG2\tB\n",
+        "H.tsv": "HGNC\tSymbol\tAlias\nHGNC:1\tS1\tA\nHGNC:2\tS2\tB\n",
+    })
+    monkeypatch.chdir(tmp_path)
+    compute_namespaces("test", max_component_size = 3)
+    assert "WARNING: 2 components have more than 3 names" in capsys.readouterr().out
+    assert read_links(tmp_path, "Ensembl", "HGNC") == set()
+    assert read_links(tmp_path, "Symbol", "Ensembl") == {("A", "ENSG1"), ("B", "ENSG2")}
+    assert read_links(tmp_path, "Symbol", "HGNC") == {("S1", "HGNC:1"), ("A", "HGNC:1"), ("S2", "HGNC:2"), ("B", "HGNC:2")}
+
+    compute_namespaces("test", max_component_size = 4)
+    assert "WARNING" not in capsys.readouterr().out
+    assert read_links(tmp_path, "Ensembl", "HGNC") == {("ENSG1", "HGNC:1"), ("ENSG2", "HGNC:2")}
+
+def test_cache_key_covers_helper_scripts(tmp_path, monkeypatch):
+    data_path = tmp_path / "data.tsv"
+    data_path.write_text("HGNC\nHGNC:1\n")
+    scripts_dir = tmp_path / "scripts"
+    scripts_dir.mkdir()
+    for helper_script in HELPER_SCRIPTS:
+        (scripts_dir / helper_script).write_text("")
+    monkeypatch.setattr("compute_namespaces.__file__", str(scripts_dir / "compute_namespaces.py"))
+    (scripts_dir / "compute_namespaces.py").write_text("")
+    cache_key = source_cache_key(str(data_path), {}, Normalizer())
+    assert source_cache_key(str(data_path), {}, Normalizer()) == cache_key
+    (scripts_dir / "curation.py").write_text("# changed\n")
+    assert source_cache_key(str(data_path), {}, Normalizer()) != cache_key
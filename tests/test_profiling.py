@@ -0,0 +1,40 @@
+import numpy as np
+import os
+import pytest
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from profiling import Profiler
+
+ALLOCATED_BYTES = 200 << 20
+
+def allocate():
+    data = np.ones(ALLOCATED_BYTES // 8)
+    return float(data.sum())
+
+def is_resettable():
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+@pytest.mark.skipif(not is_resettable(), reason = "the peak RSS can't be reset on this platform")
+def test_stage_peak_rss(tmp_path):
+    profiler = Profiler(str(tmp_path / "profile.json"))
+    with profiler.stage("large"):
+        allocate()
+    with profiler.stage("small"):
+        pass
+    with profiler.stage("workers"):
+        with ProcessPoolExecutor(max_workers = 1, mp_context = get_context("fork")) as executor:
+            executor.submit(allocate).result()
+    large, small, workers = profiler.stages
+    assert large["peak_rss_bytes"] >= small["peak_rss_bytes"] + ALLOCATED_BYTES * 0.9
+    assert large["peak_rss_growth_bytes"] >= ALLOCATED_BYTES * 0.9
+    assert small["peak_rss_growth_bytes"] == 0
+    assert workers["peak_rss_bytes"] >= ALLOCATED_BYTES
+    assert profiler.overall_peak_rss_bytes() >= large["peak_rss_bytes"]
+    profiler.write()
+    assert os.path.isfile(tmp_path / "profile.json")
@@ -0,0 +1,122 @@
+import pytest
+import threading
+
+from compute_namespaces import compute_namespaces
+from gmara import Client
+from serve import HTTPServer, UnixHTTPServer
+
+SOURCES_YAML = """
+- data_file: H.tsv
+  columns:
+    HGNC: { namespace: HGNC }
+    Symbol: { namespace: Symbol }
+    Alias: { namespace: Symbol, is_alternative: true }
+"""
+
+@pytest.fixture
+def genes_dir(tmp_path, monkeypatch):
+    sources_dir = tmp_path / "genes/test/namespaces/sources"
+    sources_dir.mkdir(parents = True)
+    (sources_dir / "sources.yaml").write_text(SOURCES_YAML)
+    (sources_dir / "H.tsv").write_text("HGNC\tSymbol\tAlias\nHGNC:1\tS1\tA\nHGNC:2\tS2\tB\n")
+    monkeypatch.chdir(tmp_path)
+    compute_namespaces("test")
+    return str(tmp_path / "genes")
+
+def serve(server):
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    return thread
+
+def stop(server, thread):
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+def check_queries(client):
+    positions, names = client.translate("test", ["S2", "X", "A"], "Symbol", "HGNC")
+    assert list(positions) == [0, 2]
+    assert list(names) == ["HGNC:2", "HGNC:1"]
+    positions, names = client.canonicalize("test", ["B", "S1"], "Symbol")
+    assert list(positions) == [0, 1]
+    assert list(names) == ["S2", "S1"]
+
+def test_unix_socket(genes_dir, tmp_path):
+    socket_path = str(tmp_path / "gmara.sock")
+    server = UnixHTTPServer(socket_path, genes_dir = genes_dir, verbose = False)
+    thread = serve(server)
+    client = Client(f"unix:{socket_path}")
+    try:
+        check_queries(client)
+        check_queries(client)
+    finally:
+        client.close()
+        stop(server, thread)
+
+def test_tcp(genes_dir):
+    server = HTTPServer(("127.0.0.1", 0), genes_dir = genes_dir, verbose = False)
+    thread = serve(server)
+    client = Client(f"http://127.0.0.1:{server.server_address[1]}")
+    try:
+        check_queries(client)
+    finally:
+        client.close()
+        stop(server, thread)
+
+def post(client, path, body = b""):
+    with client.lock:
+        client.connection.request("POST", path, body)
+        response = client.connection.getresponse()
+        return response.status, response.read().decode()
+
+def test_errors(genes_dir):
+    server = HTTPServer(("127.0.0.1", 0), genes_dir = genes_dir, verbose = False)
+    thread = serve(server)
+    client = Client(f"http://127.0.0.1:{server.server_address[1]}")
+    try:
+        status, body = post(client, "/test/translate?from=Bogus&to=HGNC", b"S1\n")
+        assert status == 400
+        assert "unknown namespace: Bogus" in body
+        status, body = post(client, "/bogus/canonicalize?namespace=Symbol", b"S1\n")
+        assert status == 400
+        assert "unknown species: bogus" in body
+        status, body = post(client, "/test/translate?from=Symbol", b"S1\n")
+        assert status == 400
+        status, body = post(client, "/test/translate?from=Symbol&to=HGNC", b"\xff\n")
+        assert status == 400
+        check_queries(client)
+    finally:
+        client.close()
+        stop(server, thread)
+    operations = server.metrics.report()["operations"]
+    assert operations["translate"]["errors"] == 3
+    assert operations["canonicalize"]["errors"] == 1
+
+def test_internal_error(genes_dir, monkeypatch):
+    def failing_translate(self, gene_names, from_namespace_name, to_namespace_name):
+        raise ValueError("broken")
+
+    monkeypatch.setattr("gmara.Translator.translate", failing_translate)
+    server = HTTPServer(("127.0.0.1", 0), genes_dir = genes_dir, verbose = False)
+    thread = serve(server)
+    client = Client(f"http://127.0.0.1:{server.server_address[1]}")
+    try:
+        status, body = post(client, "/test/translate?from=Symbol&to=HGNC", b"S1\n")
+        assert status == 500
+        assert body == "ValueError: broken\n"
+    finally:
+        client.close()
+        stop(server, thread)
+    assert server.metrics.report()["operations"]["translate"]["errors"] == 1
+
+def test_client_url_from_environment(genes_dir, tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "gmara.sock")
+    server = UnixHTTPServer(socket_path, genes_dir = genes_dir, verbose = False)
+    thread = serve(server)
+    monkeypatch.setenv("GMARA_URL", f"unix:{socket_path}")
+    client = Client()
+    try:
+        check_queries(client)
+    finally:
+        client.close()
+        stop(server, thread)